@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from download_photos import (DEFAULT_WORKERS, DEFAULT_PER_HOST_LIMIT, open_content_store, open_export,
+                             iter_export_jobs, new_run_stats, process_job, quality_policy, report_run)
+from dedup import DEDUP_MODES
+from http_pool import ConnectionPool
+from instrumentation import Instrumentation
+from locations import load_locations
+from manifest import Manifest
+from planner import DEFAULT_MIN_REMAINING
+from timezones import load_park_timezones
+
+# Photos one account may have in flight at once, unless it sets its own limit
+DEFAULT_PER_ACCOUNT_LIMIT = 4
+
+# One export to sync into its own output directory
+Account = namedtuple('Account', [
+    'name',
+    'export',           # export file, directory of page files or glob
+    'output_dir',
+    'max_concurrent',   # per-account limit; None for the batch default
+    'quality',
+    'budget_mb',
+    'dedup',            # 'off', 'link' or 'skip'
+    'dedup_store',      # accounts naming the same store share it
+], defaults=(None, 'medium', None, 'off', None))
+
+ACCOUNT_FIELDS = set(Account._fields)
+
+def load_accounts(path):
+    """
+    Reads a batch file: a JSON list of accounts (or {"accounts": [...]}),
+    each with at least "name", "export" and "output_dir", e.g.
+        [{"name": "alice", "export": "exports/alice.json", "output_dir": "photos/alice",
+          "max_concurrent": 2}]
+    Relative paths are taken relative to the batch file.
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('accounts', [])
+    base = os.path.dirname(os.path.abspath(path))
+    accounts = []
+    for entry in data:
+        unknown = set(entry) - ACCOUNT_FIELDS
+        if unknown:
+            raise ValueError(f"Unknown field(s) for account {entry.get('name')}: {', '.join(sorted(unknown))}")
+        for key in ('export', 'output_dir', 'dedup_store'):
+            if entry.get(key):
+                entry[key] = os.path.join(base, entry[key])
+        accounts.append(Account(**entry))
+    return accounts
+
+def accounts_for_exports(exports, output_root, **options):
+    """
+    One account per export file, downloading into `output_root/<export name>`
+    (or straight into `output_root` when there is only one export).
+    `options` fill in the other Account fields.
+    """
+    if len(exports) == 1:
+        return [Account("photos", exports[0], output_root, **options)]
+    accounts = []
+    for export in exports:
+        name = os.path.splitext(os.path.basename(export.rstrip("/\\")))[0]
+        accounts.append(Account(name, export, os.path.join(output_root, name), **options))
+    return accounts
+
+class AccountRun:
+    """
+    One account's open export, manifest, job stream and counts during a batch.
+    """
+
+    def __init__(self, account, locations, timezones, stores, incremental, min_remaining, per_account_limit):
+        self.account = account
+        self.limit = max(1, account.max_concurrent or per_account_limit)
+        self.in_flight = 0
+        self.stats = new_run_stats()
+        self.reader = open_export(account.export)
+        self.manifest = None
+        self.store = None
+        self.jobs = None
+        if not self.reader:
+            return
+        os.makedirs(account.output_dir, exist_ok=True)
+        self.manifest = Manifest(account.output_dir)
+        if account.dedup != 'off':
+            # Accounts sharing a dedup store share one ContentStore for it
+            store_path = account.dedup_store or account.output_dir
+            self.store = stores.get(store_path)
+            if self.store is None:
+                self.store = stores[store_path] = open_content_store(account.output_dir, account.dedup,
+                                                                     account.dedup_store)
+        self.jobs = iter_export_jobs(self.reader, locations, account.output_dir, self.manifest, incremental,
+                                     self.stats, min_remaining, quality_policy(account.quality),
+                                     account.budget_mb, timezones)
+
+    def next_job(self):
+        """
+        Returns the account's next job, or None once its export is exhausted.
+        """
+        if self.jobs is None:
+            return None
+        job = next(self.jobs, None)
+        if job is None:
+            self.jobs = None
+        return job
+
+    def close(self):
+        if self.manifest is not None:
+            self.manifest.close()
+
+def run_batch(accounts, workers=DEFAULT_WORKERS, per_account_limit=DEFAULT_PER_ACCOUNT_LIMIT,
+              per_host_limit=DEFAULT_PER_HOST_LIMIT, incremental=True, min_remaining=DEFAULT_MIN_REMAINING,
+              instrumentation=None):
+    """
+    Downloads several accounts' exports, each into its own output directory,
+    on one shared pool of `workers` threads and keep-alive connections.
+    Accounts take turns round-robin for free workers, and none has more
+    than its `max_concurrent` (default `per_account_limit`) photos in flight,
+    so a large account can't starve the small ones while total throughput
+    stays at `workers`. Each account keeps its own manifest, expiry order,
+    budget and dedup settings, as in download_photos().
+    Returns {account name: photos downloaded}.
+    """
+    locations = load_locations()
+    timezones = load_park_timezones()
+    instr = instrumentation or Instrumentation()
+    stores = {}
+    runs = []
+    pool = ConnectionPool(per_host_limit=per_host_limit)
+    try:
+        for account in accounts:
+            runs.append(AccountRun(account, locations, timezones, stores, incremental, min_remaining,
+                                   per_account_limit))
+        ready = deque(run for run in runs if run.jobs is not None)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while ready or pending:
+                # Hand out free workers one job per account per turn
+                waiting = deque()
+                while ready and len(pending) < workers:
+                    run = ready.popleft()
+                    if run.in_flight >= run.limit:
+                        waiting.append(run)
+                        continue
+                    job = run.next_job()
+                    if job is None:
+                        continue
+                    run.in_flight += 1
+                    future = executor.submit(process_job, job, pool, run.manifest, run.store,
+                                             run.account.dedup, instr, incremental)
+                    pending[future] = run
+                    ready.append(run)
+                ready.extendleft(reversed(waiting))
+                if not pending:
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    run = pending.pop(future)
+                    run.in_flight -= 1
+                    run.stats[future.result()] += 1
+    finally:
+        pool.close()
+        for run in runs:
+            run.close()
+        for store in stores.values():
+            if store is not None:
+                store.close()
+        instr.close()
+
+    results = {}
+    for run in runs:
+        print(f"[{run.account.name}] -> {run.account.output_dir}")
+        results[run.account.name] = report_run(run.reader, run.stats) if run.reader else 0
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download and tag PhotoPass photos for one or more exports.")
+    parser.add_argument('exports', nargs='*', default=["photos.json"],
+                        help="export files, page directories or globs (default: photos.json)")
+    parser.add_argument('-o', '--output', default="downloaded_photos",
+                        help="output directory; with several exports, each gets a subdirectory named after it")
+    parser.add_argument('--accounts', help="JSON batch file listing accounts (see batch.load_accounts)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="downloads in flight across all accounts")
+    parser.add_argument('--per-account', type=int, default=DEFAULT_PER_ACCOUNT_LIMIT,
+                        help="downloads in flight per account")
+    parser.add_argument('--per-host-limit', type=int, default=DEFAULT_PER_HOST_LIMIT)
+    parser.add_argument('--quality', default='medium', help="thumb, medium, base or best (ignored with --accounts)")
+    parser.add_argument('--dedup', default='off', choices=DEDUP_MODES, help="ignored with --accounts")
+    parser.add_argument('--full', action='store_true', help="re-download photos already in the manifest")
+    parser.add_argument('--dry-run', action='store_true', help="print what would be downloaded and exit")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.accounts:
+        accounts = load_accounts(args.accounts)
+    else:
+        accounts = accounts_for_exports(args.exports, args.output, quality=args.quality, dedup=args.dedup)
+
+    if args.dry_run:
+        from sync_plan import plan_sync
+        for account in accounts:
+            print(f"[{account.name}] -> {account.output_dir}")
+            plan_sync(account.export, account.output_dir, account.quality)
+        return
+    run_batch(accounts, workers=args.workers, per_account_limit=args.per_account,
+              per_host_limit=args.per_host_limit, incremental=not args.full)
+
+if __name__ == "__main__":
+    main()
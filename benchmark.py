@@ -0,0 +1,374 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from PIL import Image
+
+import copy_exif
+from image_metadata import splice_exif
+import create_example
+import download_photos as downloader
+from instrumentation import Instrumentation
+from timezones import DEFAULT_TIMEZONE, get_zone
+
+TARGETS = ('download', 'copy_exif')
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "photos_example.json")
+
+def make_jpeg(width, height, seed, quality=85):
+    """
+    Returns a noisy JPEG of roughly realistic size (smooth images compress
+    far better than real photos would).
+    """
+    rng = random.Random(seed)
+    img = Image.effect_noise((width, height), 64).convert('RGB')
+    tint = Image.new('RGB', (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    out = io.BytesIO()
+    Image.blend(img, tint, 0.5).save(out, 'JPEG', quality=quality)
+    return out.getvalue()
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        if random.random() < server.error_rate:
+            body = b"<Error><Code>SlowDown</Code></Error>"
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        # The same path always gets the same image
+        data = server.images[zlib.crc32(urlsplit(self.path).path.encode()) % len(server.images)]
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and range_header.startswith("bytes=") and range_header.endswith("-"):
+            start = int(range_header[6:-1])
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if random.random() < server.drop_rate:
+            # Cut the transfer off halfway to exercise retries and Range resume
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            with server.lock:
+                server.bytes_sent += len(body) // 2
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        self.wfile.write(body)
+        with server.lock:
+            server.bytes_sent += len(body)
+            server.requests += 1
+
+class FakeS3Server(ThreadingHTTPServer):
+    """
+    Local stand-in for the PhotoPass S3 bucket. Serves `images` (JPEG bytes)
+    for any path, after `latency` + up to `jitter` seconds, answering a
+    fraction `error_rate` of requests with 503 and cutting off a fraction
+    `drop_rate` of transfers partway. Honours `Range: bytes=N-`.
+    """
+    daemon_threads = True
+
+    def __init__(self, images, latency=0.0, jitter=0.0, error_rate=0.0, drop_rate=0.0, port=0):
+        super().__init__(('127.0.0.1', port), FakeS3Handler)
+        self.images = images
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.lock = threading.Lock()
+        self.bytes_sent = 0
+        self.requests = 0
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+def _localize_uri(uri, base_url, signed_at):
+    parts = urlsplit(uri)
+    base = urlsplit(base_url)
+    query = dict(parse_qsl(parts.query))
+    query['X-Amz-Date'] = signed_at
+    query['X-Amz-Expires'] = '86400'
+    return urlunsplit((base.scheme, base.netloc, parts.path, urlencode(query), ""))
+
+def generate_export(path, encounters, media_per_encounter, base_url, seed=0, template_path=TEMPLATE_PATH):
+    """
+    Writes a synthetic all-media export with `encounters` x `media_per_encounter`
+    photos, built from photos_example.json with create_example's randomizers.
+    Every link points at `base_url` and stays valid for a day.
+    Returns the number of media items.
+    """
+    random.seed(seed)
+    with open(template_path, 'r', encoding='utf-8') as f:
+        template = json.load(f)
+    templates = template['guestMedia']['encounters']
+    signed_at = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+    new_encounters = []
+    for i in range(encounters):
+        encounter = create_example.randomize_encounter(templates[i % len(templates)])
+        seeds = encounter['mediaList'] or templates[0]['mediaList']
+        media_list = []
+        for j in range(media_per_encounter):
+            media = create_example.randomize_media(seeds[j % len(seeds)], encounter['encounterId'])
+            for key in ("mediaThumb", "mediaMedium", "mediaBase"):
+                if media.get(key) and media[key].get('uri'):
+                    media[key] = dict(media[key], uri=_localize_uri(media[key]['uri'], base_url, signed_at))
+            media_list.append(media)
+        encounter['mediaList'] = media_list
+        new_encounters.append(encounter)
+
+    template['guestMedia']['encounters'] = new_encounters
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(template, f)
+    return encounters * media_per_encounter
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+def peak_rss_mb(who='self'):
+    """
+    Peak resident set size of this process ('self') or of its largest
+    finished child ('children'), in MB. None where unsupported.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss * scale / (1024 * 1024)
+
+@contextlib.contextmanager
+def timed_calls(module, name, latencies):
+    """
+    Temporarily wraps module.name so each call's duration lands in `latencies`.
+    """
+    original = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    setattr(module, name, wrapper)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+_copy_exif_task = copy_exif._copy_exif_task
+
+def _timed_copy_task(task):
+    # Runs in copy_exif's worker processes, so timings go through a file
+    start = time.perf_counter()
+    result = _copy_exif_task(task)
+    with open(os.environ['PHOTOPASS_BENCH_LATENCIES'], 'a') as f:
+        f.write(f"{time.perf_counter() - start}\n")
+    return result
+
+def stage_means(instr):
+    # Mean milliseconds per stage, from the run's instrumentation
+    return {stage: round(t['mean'] * 1000, 2) for stage, t in instr.snapshot()['stages'].items() if t['count']}
+
+def summarize(name, count, elapsed, total_bytes, latencies, **extra):
+    result = {
+        'target': name,
+        'photos': count,
+        'seconds': round(elapsed, 3),
+        'photos_per_sec': round(count / elapsed, 1) if elapsed else None,
+        'mb_per_sec': round(total_bytes / (1024 * 1024) / elapsed, 2) if elapsed else None,
+        'p50_ms': None,
+        'p99_ms': None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if latencies:
+        result['p50_ms'] = round(percentile(latencies, 50) * 1000, 1)
+        result['p99_ms'] = round(percentile(latencies, 99) * 1000, 1)
+    result.update(extra)
+    return result
+
+def bench_download(work_dir, args):
+    """
+    Times download_photos() against the fake S3 server.
+    """
+    images = [make_jpeg(args.width, args.height, seed) for seed in range(args.images)]
+    with FakeS3Server(images, args.latency / 1000, args.jitter / 1000, args.error_rate, args.drop_rate) as server:
+        export_path = os.path.join(work_dir, "photos.json")
+        generate_export(export_path, args.encounters, args.media, server.base_url, args.seed)
+        output_dir = os.path.join(work_dir, "downloaded_photos")
+
+        latencies = []
+        with timed_calls(downloader, 'process_job', latencies), open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            instr = Instrumentation(progress=False)
+            count = downloader.download_photos(export_path, output_dir, workers=args.workers,
+                                               per_host_limit=args.per_host_limit, incremental=False,
+                                               instrumentation=instr)
+            elapsed = time.perf_counter() - start
+
+        return summarize('download', count, elapsed, server.bytes_sent, latencies,
+                         requests=server.requests, workers=args.workers, stages=stage_means(instr))
+
+def build_library(source_dir, count, images):
+    """
+    Writes `count` tagged JPEGs named like download_photos() output, without
+    any network, as the source side of a copy_exif run.
+    """
+    os.makedirs(source_dir, exist_ok=True)
+    start = datetime(2026, 1, 1, 15, tzinfo=timezone.utc)
+    for i in range(count):
+        capture_dt = start + timedelta(minutes=7 * i)
+        local_dt = capture_dt.astimezone(get_zone(DEFAULT_TIMEZONE))
+        exif_bytes, _ = downloader.build_exif_bytes(capture_dt, local_dt, None)
+        name = f"{capture_dt.strftime('%Y-%m-%d_%H-%M-%S')}_{i:010d}.jpg"
+        with open(os.path.join(source_dir, name), 'wb') as f:
+            f.write(splice_exif(images[i % len(images)], exif_bytes))
+
+def bench_copy_exif(work_dir, args):
+    """
+    Times copy_exif_data() from a downloaded library (reused from --work-dir,
+    or generated) into a copy of it.
+    """
+    source_dir = os.path.join(work_dir, "downloaded_photos")
+    if not os.path.isdir(source_dir):
+        images = [make_jpeg(args.width, args.height, seed) for seed in range(args.images)]
+        build_library(source_dir, args.encounters * args.media, images)
+        del images
+    target_dir = os.path.join(work_dir, "cleaned")
+    shutil.rmtree(target_dir, ignore_errors=True)
+    shutil.copytree(source_dir, target_dir, ignore=shutil.ignore_patterns(".*"))
+    total_bytes = sum(entry.stat().st_size for entry in os.scandir(target_dir))
+
+    latency_log = os.path.join(work_dir, "copy_exif_latencies.txt")
+    open(latency_log, 'w').close()
+    os.environ['PHOTOPASS_BENCH_LATENCIES'] = latency_log
+    copy_exif._copy_exif_task = _timed_copy_task
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            instr = Instrumentation(progress=False)
+            copy_exif.copy_exif_data(source_dir, target_dir, workers=args.copy_workers, instrumentation=instr)
+            elapsed = time.perf_counter() - start
+    finally:
+        copy_exif._copy_exif_task = _copy_exif_task
+
+    with open(latency_log) as f:
+        latencies = [float(line) for line in f if line.strip()]
+    return summarize('copy_exif', len(latencies), elapsed, total_bytes, latencies,
+                     worker_peak_rss_mb=peak_rss_mb('children') or None, workers=args.copy_workers or os.cpu_count(),
+                     stages=stage_means(instr))
+
+BENCHMARKS = {
+    'download': bench_download,
+    'copy_exif': bench_copy_exif,
+}
+
+def print_result(result):
+    def fmt(value, unit=""):
+        return "n/a" if value is None else f"{value:.1f}{unit}" if isinstance(value, float) else f"{value}{unit}"
+    print(f"{result['target']}: {result['photos']} photos in {result['seconds']:.2f}s | "
+          f"{fmt(result['photos_per_sec'])} photos/s | {fmt(result['mb_per_sec'])} MB/s | "
+          f"p50 {fmt(result['p50_ms'], ' ms')} | p99 {fmt(result['p99_ms'], ' ms')} | "
+          f"peak RSS {fmt(result['peak_rss_mb'], ' MB')}")
+    if result.get('stages'):
+        print("  mean per stage: " + ", ".join(f"{stage} {ms} ms" for stage, ms in result['stages'].items()))
+    if result.get('worker_peak_rss_mb') is not None:
+        print(f"  worker peak RSS {fmt(result['worker_peak_rss_mb'], ' MB')}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark download_photos and copy_exif against a local fake S3 server.")
+    parser.add_argument('target', nargs='?', default='all', choices=TARGETS + ('all',))
+    parser.add_argument('--encounters', type=int, default=20)
+    parser.add_argument('--media', type=int, default=10, help="photos per encounter")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=853)
+    parser.add_argument('--images', type=int, default=8, help="distinct JPEGs served")
+    parser.add_argument('--latency', type=float, default=20, help="per-request latency, ms")
+    parser.add_argument('--jitter', type=float, default=10, help="extra random latency, ms")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="fraction of transfers cut off halfway")
+    parser.add_argument('--workers', type=int, default=downloader.DEFAULT_WORKERS)
+    parser.add_argument('--per-host-limit', type=int, default=downloader.DEFAULT_PER_HOST_LIMIT)
+    parser.add_argument('--copy-workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', help="keep generated files here instead of a temp dir")
+    parser.add_argument('--json', action='store_true', help="print results as JSON lines")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.target == 'all':
+        # One process per target so each gets its own peak RSS
+        argv = sys.argv[1:] if argv is None else list(argv)
+        argv = [a for a in argv if a != 'all']
+        for target in TARGETS:
+            subprocess.run([sys.executable, os.path.abspath(__file__), target] + argv, check=True)
+        return
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="photopass-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        result = BENCHMARKS[args.target](work_dir, args)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print_result(result)
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,158 @@
 import os
+import re
 import shutil
-import piexif
-from PIL import Image
-import platform
+from concurrent.futures import ProcessPoolExecutor
+from file_times import created_ns, set_times
+from image_metadata import read_exif, write_exif
+from instrumentation import Instrumentation
 import time
 
-def set_creation_time(path, timestamp):
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# Name decorations editing tools add to cleaned copies; stripped before matching
+DEFAULT_PREFIXES = ('cleaned_', 'clean_', 'edited_', 'nowm_')
+DEFAULT_SUFFIXES = ('_cleaned', '_clean', '_edited', '-edited', '_nowm', '_no_watermark')
+
+# The <timestamp>_<mediaId> stem download_photos gives every file
+DOWNLOAD_STEM = re.compile(r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}_[0-9a-z]+')
+
+def normalize_name(filename, prefixes=DEFAULT_PREFIXES, suffixes=DEFAULT_SUFFIXES):
+    """
+    Reduces a filename to its matching key: lowercased, extension dropped,
+    known prefixes/suffixes stripped, and cut down to the
+    <timestamp>_<mediaId> stem when one is present.
     """
-    Sets the file creation time on Windows.
-    Falls back to os.utime on other systems (which sets modified/access time).
+    stem = os.path.splitext(filename)[0].lower()
+    stripped = True
+    while stripped:
+        stripped = False
+        for prefix in prefixes:
+            if prefix and stem.startswith(prefix):
+                stem = stem[len(prefix):]
+                stripped = True
+        for suffix in suffixes:
+            if suffix and stem.endswith(suffix):
+                stem = stem[:-len(suffix)]
+                stripped = True
+    match = DOWNLOAD_STEM.search(stem)
+    if match:
+        return match.group(0)
+    return stem
+
+class SourceIndex:
+    """
+    Hash index over the source directory, built from a single os.scandir pass.
+    Looks targets up by exact filename first, then by normalized name, so
+    each match is O(1) and needs no os.path.exists call.
     """
-    if platform.system() == 'Windows':
-        try:
-            import ctypes
-            from ctypes import wintypes, byref
-
-            # Define the required structures and constants
-            FILE_WRITE_ATTRIBUTES = 0x0100
-            OPEN_EXISTING = 3
-            
-            # CreateFileW signature
-            CreateFileW = ctypes.windll.kernel32.CreateFileW
-            CreateFileW.restype = wintypes.HANDLE
-            CreateFileW.argtypes = [
-                wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD,
-                wintypes.LPVOID, wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE
-            ]
-
-            # SetFileTime signature
-            SetFileTime = ctypes.windll.kernel32.SetFileTime
-            SetFileTime.restype = wintypes.BOOL
-            SetFileTime.argtypes = [
-                wintypes.HANDLE, ctypes.POINTER(wintypes.FILETIME),
-                ctypes.POINTER(wintypes.FILETIME), ctypes.POINTER(wintypes.FILETIME)
-            ]
-
-            CloseHandle = ctypes.windll.kernel32.CloseHandle
-            
-            t = int((timestamp * 10000000) + 116444736000000000)
-            c_creation_time = wintypes.FILETIME(t & 0xFFFFFFFF, t >> 32)
-
-            handle = CreateFileW(path, FILE_WRITE_ATTRIBUTES, 0, None, OPEN_EXISTING, 128, None)
-            
-            if handle == -1:
-                return
-
-            SetFileTime(handle, byref(c_creation_time), None, None)
-            CloseHandle(handle)
-        except Exception as e:
-            print(f"Failed to set creation time: {e}")
-
-def copy_exif_data(source_dir, target_dir):
+
+    def __init__(self, source_dir, prefixes=DEFAULT_PREFIXES, suffixes=DEFAULT_SUFFIXES):
+        self.prefixes = tuple(p.lower() for p in prefixes)
+        self.suffixes = tuple(s.lower() for s in suffixes)
+        self.exact = {}
+        self.normalized = {}
+        with os.scandir(source_dir) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if not entry.is_file():
+                    continue
+                self.exact[entry.name] = entry.path
+                if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    key = normalize_name(entry.name, self.prefixes, self.suffixes)
+                    # Prefer a JPEG original when several sources share a key
+                    current = self.normalized.get(key)
+                    if current is None or (entry.name.lower().endswith(JPEG_EXTENSIONS)
+                                           and not current.lower().endswith(JPEG_EXTENSIONS)):
+                        self.normalized[key] = entry.path
+
+    def __len__(self):
+        return len(self.exact)
+
+    def lookup(self, filename):
+        """
+        Returns the source path matching a target filename, or None.
+        """
+        path = self.exact.get(filename)
+        if path is None:
+            path = self.normalized.get(normalize_name(filename, self.prefixes, self.suffixes))
+        return path
+
+def copy_exif_file(filename, source_path, target_path):
+    """
+    Copies EXIF and file timestamps from one source image to its target.
+    Runs inside pool workers, so it reports back instead of printing.
+    Returns (updated, messages, warnings, timings), where timings holds the
+    seconds spent per stage (exif_read, insert, utime).
+    """
+    messages = []
+    warnings = []
+    timings = {}
+    try:
+        # Read EXIF from source
+        # JPEG sources are read header-only; Pillow handles anything else
+        start = time.perf_counter()
+        exif_bytes = read_exif(source_path)
+        timings['exif_read'] = time.perf_counter() - start
+        if not exif_bytes:
+            return False, messages, [f"No EXIF in source for {filename}"], timings
+
+        # Get source timestamps, to the nanosecond
+        src_stat = os.stat(source_path)
+
+        def copy_times(fd):
+            # Copy File Timestamps (Modified/Access, and Creation on Windows) in one call,
+            # through the new file's fd before it is renamed into place
+            start = time.perf_counter()
+            try:
+                set_times(fd, src_stat.st_mtime_ns, src_stat.st_atime_ns, created_ns(src_stat))
+            except Exception as e:
+                warnings.append(f"  -> Warning: Could not copy timestamps for {filename}: {e}")
+            timings['utime'] = time.perf_counter() - start
+
+        # Write to target
+        # EXIF is written at the container level (JPEG APP1, PNG eXIf, WebP EXIF chunk),
+        # so pixel data is never decoded or re-encoded
+        start = time.perf_counter()
+        image_format = write_exif(target_path, exif_bytes, finish=copy_times)
+        timings['insert'] = time.perf_counter() - start - timings.get('utime', 0.0)
+        if image_format == "JPEG":
+            messages.append(f"Copied EXIF for {filename}")
+        else:
+            messages.append(f"Copied EXIF for {filename} ({image_format})")
+        updated = True
+
+        return updated, messages, warnings, timings
+    except Exception as e:
+        return False, messages, warnings + [f"Failed to copy EXIF for {filename}: {e}"], timings
+
+def _copy_exif_task(task):
+    return copy_exif_file(*task)
+
+def _report_results(results, tasks, instr):
+    count = 0
+    for (filename, _, target_path), (updated, messages, warnings, timings) in zip(tasks, results):
+        for message in messages:
+            instr.info(message)
+        for warning in warnings:
+            instr.warn(warning)
+        instr.add_timings(timings)
+        if updated:
+            count += 1
+            instr.item_done('done', os.path.getsize(target_path), file=filename, stages=timings)
+        else:
+            instr.item_done('failed', file=filename, stages=timings)
+    return count
+
+def copy_exif_data(source_dir, target_dir, workers=None, prefixes=DEFAULT_PREFIXES, suffixes=DEFAULT_SUFFIXES,
+                   instrumentation=None):
     """
     Copies EXIF data from source images to target images if filenames match.
+    Names match exactly, or after ignoring case, extension and the given
+    `prefixes`/`suffixes` (see normalize_name).
+    The source directory is indexed once up front, then the transfers are
+    spread over `workers` processes (default: one per CPU; 1 runs in-process).
+    Progress and stage timings go to `instrumentation` (see
+    instrumentation.Instrumentation); by default a progress line is shown.
     """
     if not os.path.exists(source_dir):
         print(f"Source directory not found: {source_dir}")
@@ -62,77 +162,35 @@ def copy_exif_data(source_dir, target_dir):
         print(f"Target directory not found: {target_dir}")
         return
 
+    source_index = SourceIndex(source_dir, prefixes, suffixes)
+
     # Get list of files in target directory
-    target_files = [f for f in os.listdir(target_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))]
+    target_files = [f for f in os.listdir(target_dir) if f.lower().endswith(IMAGE_EXTENSIONS)]
     
     print(f"Found {len(target_files)} images in {target_dir} to process.")
     
-    count = 0
+    instr = instrumentation or Instrumentation(unit="images")
+    tasks = []
     for filename in target_files:
-        target_path = os.path.join(target_dir, filename)
-        source_path = os.path.join(source_dir, filename)
-        
-        # Try to find exact match first
-        if not os.path.exists(source_path):
-            # Try to find match without "cleaned_" prefix if it exists? 
-            # Or maybe the cleaned files have same name. Assuming same name for now based on user request.
-            # If the user's cleaned files have a suffix/prefix, we might need to adjust logic.
-            # Let's check if there's a file with same name
-            pass
-
-        if os.path.exists(source_path):
-            try:
-                # Read EXIF from source
-                # distinct handling for different formats if needed, but piexif works with jpg/webp mostly
-                # Pillow is safer for general metadata reading
-                
-                src_img = Image.open(source_path)
-                if 'exif' in src_img.info:
-                    exif_bytes = src_img.info['exif']
-                    
-                    # Write to target
-                    # For PNG, piexif might not work directly, need to check format
-                    if target_path.lower().endswith(('.jpg', '.jpeg')):
-                        # Reload target image to avoid file lock issues if any, though piexif.insert takes path
-                        piexif.insert(exif_bytes, target_path)
-                        print(f"Copied EXIF for {filename}")
-                        count += 1
-                    elif target_path.lower().endswith('.png'):
-                         # PNG metadata handling is different, Pillow can save it but piexif is mainly for JPEG
-                         # We can try to save it using Pillow. Opening target again.
-                         tgt_img = Image.open(target_path)
-                         tgt_img.save(target_path, exif=exif_bytes)
-                         print(f"Copied EXIF for {filename} (PNG re-saved)")
-                         count += 1
-                    elif target_path.lower().endswith('.webp'):
-                        tgt_img = Image.open(target_path)
-                        tgt_img.save(target_path, exif=exif_bytes)
-                        print(f"Copied EXIF for {filename} (WebP re-saved)")
-                        count += 1
-                    
-                    # Copy File Timestamps (Creation and Modified)
-                    try:
-                        # Get source timestamps
-                        src_stat = os.stat(source_path)
-                        created_time = src_stat.st_ctime
-                        modified_time = src_stat.st_mtime
-                        
-                        # Set Modified/Access Time
-                        os.utime(target_path, (src_stat.st_atime, modified_time))
-                        
-                        # Set Creation Time (Windows specific mostly)
-                        set_creation_time(target_path, created_time)
-                        
-                        # print(f"  -> Timestamps copied for {filename}")
-                    except Exception as e:
-                        print(f"  -> Warning: Could not copy timestamps for {filename}: {e}")
-
-                else:
-                    print(f"No EXIF in source for {filename}")
-            except Exception as e:
-                print(f"Failed to copy EXIF for {filename}: {e}")
+        source_path = source_index.lookup(filename)
+        if source_path is None:
+            instr.warn(f"Source file not found for {filename}")
+            continue
+        tasks.append((filename, source_path, os.path.join(target_dir, filename)))
+    instr.set_total(len(tasks))
+
+    workers = workers or os.cpu_count() or 1
+    count = 0
+    try:
+        if workers <= 1 or len(tasks) <= 1:
+            results = map(_copy_exif_task, tasks)
+            count = _report_results(results, tasks, instr)
         else:
-            print(f"Source file not found for {filename}")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunksize = max(1, min(64, len(tasks) // (workers * 4)))
+                count = _report_results(executor.map(_copy_exif_task, tasks, chunksize=chunksize), tasks, instr)
+    finally:
+        instr.close()
 
     print(f"Finished. Updated {count} images.")
 
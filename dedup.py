@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+
+from manifest import manifest_key
+
+STORE_NAME = ".photopass_content.jsonl"
+
+# What to do with a photo whose content is already in the store
+DEDUP_MODES = ('off', 'link', 'skip')
+
+class ContentStore:
+    """
+    Content-addressed index of saved photos: sha256 -> path, plus
+    mediaId -> sha256 so a media item that was already saved (in this
+    library or another one sharing the store) can be reused without
+    downloading it again.
+    Append-only JSONL like the manifest; paths are stored absolute so one
+    store can be shared by several output directories.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.by_hash = {}
+        self.by_media = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._index(entry)
+        except FileNotFoundError:
+            pass
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _index(self, entry):
+        self.by_hash.setdefault(entry['sha256'], entry['path'])
+        if entry.get('mediaKey'):
+            self.by_media[entry['mediaKey']] = entry
+
+    def find_content(self, sha256):
+        """
+        Returns the path of a saved file with this content, if it still exists.
+        """
+        path = self.by_hash.get(sha256)
+        if path and os.path.exists(path):
+            return path
+        return None
+
+    def find_media(self, job):
+        """
+        Returns (path, sha256) of an existing copy of this exact media item
+        (same mediaId, tier and modified date), or None.
+        """
+        entry = self.by_media.get(manifest_key(job['media_id'], job.get('tier')))
+        if not entry or entry.get('modified') != job.get('modified'):
+            return None
+        path = self.find_content(entry['sha256'])
+        if path is None:
+            return None
+        return path, entry['sha256']
+
+    def add(self, job, sha256, path):
+        entry = {
+            'sha256': sha256,
+            'path': os.path.abspath(path),
+            'mediaKey': manifest_key(job['media_id'], job.get('tier')),
+            'modified': job.get('modified'),
+        }
+        with self._lock:
+            self._index(entry)
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def place_duplicate(existing_path, target_path, mode):
+    """
+    Makes `target_path` a duplicate of `existing_path`: a hardlink in 'link'
+    mode, nothing at all in 'skip' mode.
+    Returns False if a hardlink couldn't be made (e.g. across drives), in
+    which case the caller should keep its own copy.
+    """
+    if mode == 'skip' or os.path.abspath(existing_path) == os.path.abspath(target_path):
+        return True
+    tmp_path = target_path + ".link"
+    try:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        os.link(existing_path, tmp_path)
+        os.replace(tmp_path, target_path)
+        return True
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
@@ -1,235 +1,819 @@
+import asyncio
+import hashlib
+import io
 import json
 import os
-import urllib.request
+import struct
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from urllib.error import HTTPError
-from datetime import datetime
 import fractions
-try:
-    from zoneinfo import ZoneInfo
-except ImportError:
-    from backports.zoneinfo import ZoneInfo # For older Python versions
 import piexif
 
-import platform
 import time
 
-def set_creation_time(path, timestamp):
+from dedup import ContentStore, DEDUP_MODES, STORE_NAME, place_duplicate
+from export_reader import ExportReader
+from file_times import set_times, to_ns
+from http_pool import ConnectionPool
+from instrumentation import Instrumentation
+from locations import LocationIndex, load_locations
+from image_metadata import JpegExifSplicer, write_exif
+from manifest import Manifest, HashingWriter
+from planner import (ExpiryScheduler, QualityPolicy, BandwidthBudget, presigned_expiry, is_expired,
+                     estimate_bytes, DEFAULT_MIN_REMAINING)
+from timezones import TimezoneMap, capture_time, convert_capture_dates, load_park_timezones
+
+# Parallel downloads; S3 is happy with a handful of connections per client
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST_LIMIT = 8
+# Max items waiting between pipeline stages in download_photos_async()
+DEFAULT_QUEUE_SIZE = 32
+
+# Downloads are written here first and renamed into place when complete
+PART_SUFFIX = ".part"
+
+# Per-photo outcomes
+DONE = 'done'
+FAILED = 'failed'
+EXPIRED = 'expired'
+DEDUPED = 'deduped'
+
+def open_export(json_file_path):
     """
-    Sets the file creation time on Windows.
-    Falls back to os.utime on other systems (which sets modified/access time).
+    Opens an export (file, directory of page files or glob) for streaming,
+    or returns None (after printing why) if no file matches.
     """
-    if platform.system() == 'Windows':
-        try:
-            import ctypes
-            from ctypes import wintypes, byref
+    reader = ExportReader(json_file_path)
+    if not reader.files:
+        print(f"Error: JSON file not found at {json_file_path}")
+        return None
+    return reader
 
-            # Define the required structures and constants
-            FILE_WRITE_ATTRIBUTES = 0x0100
-            OPEN_EXISTING = 3
-            
-            # CreateFileW signature
-            CreateFileW = ctypes.windll.kernel32.CreateFileW
-            CreateFileW.restype = wintypes.HANDLE
-            CreateFileW.argtypes = [
-                wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD,
-                wintypes.LPVOID, wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE
-            ]
-
-            # SetFileTime signature
-            SetFileTime = ctypes.windll.kernel32.SetFileTime
-            SetFileTime.restype = wintypes.BOOL
-            SetFileTime.argtypes = [
-                wintypes.HANDLE, ctypes.POINTER(wintypes.FILETIME),
-                ctypes.POINTER(wintypes.FILETIME), ctypes.POINTER(wintypes.FILETIME)
-            ]
-
-            CloseHandle = ctypes.windll.kernel32.CloseHandle
-
-            # Convert timestamp to filetime (100-nanosecond intervals since Jan 1, 1601)
-            # EPOCH_AS_FILETIME = 116444736000000000
-            # HUNDREDS_OF_NANOSECONDS = 10000000
-            
-            t = int((timestamp * 10000000) + 116444736000000000)
-            c_creation_time = wintypes.FILETIME(t & 0xFFFFFFFF, t >> 32)
+def new_run_stats():
+    return {DONE: 0, FAILED: 0, EXPIRED: 0, DEDUPED: 0, 'skipped': 0, 'over_budget': 0, 'planned_bytes': 0}
+
+def quality_policy(quality):
+    """
+    Accepts a QualityPolicy or anything its `quality` argument takes.
+    """
+    if isinstance(quality, QualityPolicy):
+        return quality
+    return QualityPolicy(quality)
+
+def _unfetched_jobs(reader, locations, output_dir, manifest, incremental, stats, policy, timezones):
+    try:
+        for job in build_jobs(reader, locations, output_dir, policy, timezones):
+            if incremental and manifest.is_current(job):
+                stats['skipped'] += 1
+                continue
+            yield job
+    except json.JSONDecodeError:
+        print(f"Error: Invalid JSON format in {reader.source}")
+
+def iter_export_jobs(reader, locations, output_dir, manifest, incremental, stats,
+                     min_remaining=DEFAULT_MIN_REMAINING, policy=None, budget_mb=None, timezones=None):
+    """
+    Streams jobs out of an export, skipping media already in the manifest,
+    soonest-expiring links first. Links with less than `min_remaining`
+    seconds left are dropped before any bandwidth is spent on them, and
+    jobs stop being admitted once their estimated sizes reach `budget_mb`.
+    Parse errors stop the stream; counts land in `stats`.
+    """
+    scheduler = ExpiryScheduler(_unfetched_jobs(reader, locations, output_dir, manifest, incremental, stats, policy,
+                                                timezones),
+                                min_remaining=min_remaining)
+    budget = BandwidthBudget(scheduler, budget_mb)
+    yield from budget
+    stats[EXPIRED] += scheduler.expired
+    stats['over_budget'] += budget.over_budget
+    stats['planned_bytes'] += budget.planned_bytes
 
-            handle = CreateFileW(path, FILE_WRITE_ATTRIBUTES, 0, None, OPEN_EXISTING, 128, None) # 128 = FILE_ATTRIBUTE_NORMAL
+def report_run(reader, stats):
+    """
+    Prints the end-of-run summary. Returns the number of photos downloaded.
+    """
+    if not reader.encounter_count:
+        print("No encounters found in JSON.")
+        return 0
+    if stats['skipped']:
+        print(f"Skipped {stats['skipped']} photos already downloaded.")
+    if stats[DEDUPED]:
+        print(f"{stats[DEDUPED]} photos were duplicates of files already saved and were not written again.")
+    if stats[EXPIRED]:
+        print(f"{stats[EXPIRED]} photos not downloaded because their links expired. "
+              f"Export a fresh photos.json to fetch them.")
+    if stats['over_budget']:
+        print(f"{stats['over_budget']} photos left for a later run to stay within the bandwidth budget.")
+    if stats['planned_bytes']:
+        print(f"Planned ~{stats['planned_bytes'] / (1024 * 1024):.1f} MB of downloads.")
+    print(f"Download complete. {stats[DONE]} photos processed.")
+    return stats[DONE]
+
+def build_jobs(encounters, locations, output_dir, policy=None, timezones=None):
+    """
+    Yields one job dict per rendition to download (one per media item
+    unless `policy` asks for several tiers), holding the URI, target
+    filename, parsed capture times and geotag (see locations.LocationIndex).
+    Capture dates are converted an encounter at a time into the park's
+    local zone (see timezones.TimezoneMap), with the filename and EXIF
+    strings formatted up front.
+    """
+    policy = policy or QualityPolicy()
+    timezones = timezones or TimezoneMap()
+    locations = locations or LocationIndex()
+    for encounter in encounters:
+        orig_park = encounter.get('origPark')
+        location = locations.lookup(encounter)
+        
+        media_list = encounter.get('mediaList', [])
+        zone = timezones.zone_for(encounter)
+        capture_times = convert_capture_dates([media.get('captureDate') for media in media_list], zone)
+        for media, times in zip(media_list, capture_times):
+            renditions = policy.choose(media)
+            if not renditions:
+                continue
             
-            if handle == -1: # INVALID_HANDLE_VALUE
-                return
+            media_id = media.get('mediaId', 'unknown')
+
+            # Name files by capture date (UTC), e.g. "2026-01-18_19-16-29_<id>"
+            if isinstance(times, Exception):
+                print(f"Warning: Could not parse date/time '{media.get('captureDate')}' ({times}). Using ID filename.")
+                times = None
+                name = f"{media_id}"
+            else:
+                name = f"{times.stamp}_{media_id}"
+
+            for variant, tier, rendition in renditions:
+                # Extra tiers requested in the same pass get a _<quality> suffix
+                filename = f"{name}_{variant}.jpg" if variant else f"{name}.jpg"
+                yield {
+                    'uri': rendition['uri'],
+                    'media_id': media_id,
+                    'variant': variant,
+                    'tier': tier,
+                    'width': rendition.get('width'),
+                    'height': rendition.get('height'),
+                    'est_bytes': estimate_bytes(rendition),
+                    'expires': presigned_expiry(rendition['uri']),
+                    'etag': encounter.get('encounterEtag'),
+                    'modified': media.get('guestMediaModifiedDate'),
+                    'filename': filename,
+                    'filepath': os.path.join(output_dir, filename),
+                    'capture_dt': times.utc if times else None,
+                    'local_dt': times.local if times else None,
+                    'times': times,
+                    'orig_park': orig_park,
+                    'location': location,
+                }
+
+def build_exif_dict(datetime_original, offset_exif, gps_date, gps_time, location):
+    """
+    Builds the piexif dict (camera info, local time + offset, GPS) from
+    already-formatted timestamp fields.
+    """
+    exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+
+    # 0th IFD
+    exif_dict["0th"][piexif.ImageIFD.Make] = "Disney Photo Pass"
+    exif_dict["0th"][piexif.ImageIFD.Model] = "Disney Photo Pass"
+    exif_dict["0th"][piexif.ImageIFD.Software] = "Disney Photo Pass"
+    exif_dict["0th"][piexif.ImageIFD.DateTime] = datetime_original
+
+    # Exif IFD
+    exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal] = datetime_original
+    exif_dict["Exif"][piexif.ExifIFD.DateTimeDigitized] = datetime_original
+    exif_dict["Exif"][piexif.ExifIFD.OffsetTime] = offset_exif
+    exif_dict["Exif"][piexif.ExifIFD.OffsetTimeOriginal] = offset_exif
+    exif_dict["Exif"][piexif.ExifIFD.OffsetTimeDigitized] = offset_exif
+
+    # GPS IFD
+    # DMS values come precomputed with the Location
+    if location:
+        exif_dict["GPS"][piexif.GPSIFD.GPSLatitudeRef] = location.gps_lat_ref
+        exif_dict["GPS"][piexif.GPSIFD.GPSLatitude] = location.gps_lat
+        exif_dict["GPS"][piexif.GPSIFD.GPSLongitudeRef] = location.gps_lon_ref
+        exif_dict["GPS"][piexif.GPSIFD.GPSLongitude] = location.gps_lon
+
+        # GPS Timestamp (UTC)
+        exif_dict["GPS"][piexif.GPSIFD.GPSTimeStamp] = gps_time
+        exif_dict["GPS"][piexif.GPSIFD.GPSDateStamp] = gps_date
+
+    return exif_dict
+
+# Placeholders dumped into an ExifTemplate and overwritten per photo.
+# Each is exactly as long as the real value it stands for.
+TEMPLATE_DATETIME = b"0000:00:00 00:00:01"
+TEMPLATE_OFFSET = b"+00:01"
+TEMPLATE_GPS_DATE = b"0000:00:02"
+TEMPLATE_GPS_TIME = ((0x7FFF0001, 1), (0x7FFF0002, 1), (0x7FFF0003, 1))
+
+def _find_all(data, needle):
+    positions = []
+    pos = data.find(needle)
+    while pos != -1:
+        positions.append(pos)
+        pos = data.find(needle, pos + 1)
+    return positions
+
+class ExifTemplate:
+    """
+    A pre-serialized EXIF block for one location. The constant 0th IFD
+    entries and the GPS position are dumped once; render() only copies the
+    bytes and overwrites the date/offset fields in place.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        exif_dict = build_exif_dict(TEMPLATE_DATETIME, TEMPLATE_OFFSET, TEMPLATE_GPS_DATE,
+                                    TEMPLATE_GPS_TIME, location)
+        self.has_gps = bool(exif_dict["GPS"])
+        self.template = piexif.dump(exif_dict)
+        # piexif writes big-endian TIFF, rationals as two unsigned longs
+        gps_time_bytes = b"".join(struct.pack(">LL", n, d) for n, d in TEMPLATE_GPS_TIME)
+        self.datetime_pos = _find_all(self.template, TEMPLATE_DATETIME)
+        self.offset_pos = _find_all(self.template, TEMPLATE_OFFSET)
+        self.gps_date_pos = _find_all(self.template, TEMPLATE_GPS_DATE)
+        self.gps_time_pos = _find_all(self.template, gps_time_bytes)
+        gps_fields = 1 if self.has_gps else 0
+        self.usable = (len(self.datetime_pos) == 3 and len(self.offset_pos) == 3
+                       and len(self.gps_date_pos) == gps_fields and len(self.gps_time_pos) == gps_fields)
+
+    def render(self, capture_dt, local_dt, times=None):
+        """
+        Returns (exif_bytes, offset_str_exif) for one photo. `times` (a
+        timezones.CaptureTime) supplies the formatted fields when the caller
+        already has them.
+        """
+        times = times or capture_time(capture_dt, local_dt)
+        datetime_original = times.datetime_original
+        offset_str_exif = times.offset
+        offset_exif = offset_str_exif.encode('utf-8')
+        gps_date = times.gps_date
+        gps_time = ((capture_dt.hour, 1), (capture_dt.minute, 1), (capture_dt.second, 1))
+
+        if not (self.usable and len(datetime_original) == len(TEMPLATE_DATETIME)
+                and len(offset_exif) == len(TEMPLATE_OFFSET) and len(gps_date) == len(TEMPLATE_GPS_DATE)):
+            # Odd-length values (e.g. years before 1000) can't be patched in place
+            exif_dict = build_exif_dict(datetime_original, offset_exif, gps_date, gps_time, self.location)
+            return piexif.dump(exif_dict), offset_str_exif
+
+        buf = bytearray(self.template)
+        for pos in self.datetime_pos:
+            buf[pos:pos + len(datetime_original)] = datetime_original
+        for pos in self.offset_pos:
+            buf[pos:pos + len(offset_exif)] = offset_exif
+        for pos in self.gps_date_pos:
+            buf[pos:pos + len(gps_date)] = gps_date
+        for pos in self.gps_time_pos:
+            buf[pos:pos + 24] = struct.pack(">LLLLLL", capture_dt.hour, 1, capture_dt.minute, 1, capture_dt.second, 1)
+        return bytes(buf), offset_str_exif
+
+_exif_templates = {}
 
-            SetFileTime(handle, byref(c_creation_time), None, None)
-            CloseHandle(handle)
-        except Exception as e:
-            print(f"Failed to set creation time: {e}")
-    else:
-        # On Linux/Unix, creation time (birthtime) is hard to change reliably from Python
+def get_exif_template(location, tz_key):
+    """
+    Returns the cached ExifTemplate for a location + timezone, building it on first use.
+    """
+    key = (location, tz_key)
+    template = _exif_templates.get(key)
+    if template is None:
+        template = ExifTemplate(location)
+        _exif_templates[key] = template
+    return template
+
+def build_exif_bytes(capture_dt, local_dt, location, times=None):
+    """
+    Builds the EXIF block (camera info, local time + offset, GPS) for one photo
+    from the cached template for its location and timezone.
+    `location` is a locations.Location, or None for no GPS.
+    Returns (exif_bytes, offset_str_exif).
+    """
+    template = get_exif_template(location, str(local_dt.tzinfo))
+    return template.render(capture_dt, local_dt, times)
+
+def set_file_times(target, capture_dt, instr=None):
+    """
+    Update File System Timestamps (Modified, Access and, on Windows, Created)
+    to the capture time. `target` is a path or the fd of an open file whose
+    writes have been flushed (see file_times.set_times).
+    """
+    try:
+        set_times(target, to_ns(capture_dt))
+    except Exception as e:
+        (instr.warn if instr else print)(f"  -> Warning: Could not set file timestamps: {e}")
+
+def tag_log_line(job, offset_str_exif):
+    log_extras = []
+    if job['location']: log_extras.append(f"GPS:{job['location'].name}")
+    log_extras.append(f"Time:{job['local_dt']} ({offset_str_exif})")
+    return f"  -> Tagged {job['filename']} [{' '.join(log_extras)}]"
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
         pass
 
-def to_deg(value, loc):
+def reuse_duplicate(job, existing_path, sha256, size, manifest, dedup, instr):
+    """
+    Makes `job`'s file a duplicate of `existing_path` (see dedup.place_duplicate)
+    and records it. Returns False if the caller should keep its own copy.
+    """
+    if not place_duplicate(existing_path, job['filepath'], dedup):
+        return False
+    if manifest is not None:
+        manifest.record(job, size, sha256, existing_path if dedup == 'skip' else None)
+    action = "Skipped" if dedup == 'skip' else "Linked"
+    instr.info(f"  -> {action} {job['filename']}: same content as {os.path.basename(existing_path)}")
+    return True
+
+def reuse_known_media(job, manifest, store, dedup, instr, incremental=True):
+    """
+    Reuses an earlier copy of this exact media item from the content store
+    instead of downloading it again. Without `incremental`, the job's own
+    file doesn't count, so a full re-download really fetches it.
+    Returns True if it was reused.
+    """
+    if store is None:
+        return False
+    found = store.find_media(job)
+    if found is None:
+        return False
+    existing_path, sha256 = found
+    if not incremental and os.path.abspath(existing_path) == os.path.abspath(job['filepath']):
+        return False
+    return reuse_duplicate(job, existing_path, sha256, os.path.getsize(existing_path), manifest, dedup, instr)
+
+def process_job(job, pool, manifest=None, store=None, dedup='off', instr=None, incremental=True):
+    """
+    Downloads a single photo, then tags it and sets its file times.
+    The EXIF block is spliced into the stream as it downloads, so the file
+    is written exactly once: into `<name>.part`, which is renamed into
+    place only when complete. Transient errors are retried and dropped
+    transfers resumed by the pool.
+    Finished photos are recorded in `manifest` when one is given.
+    With a content `store`, media already saved elsewhere is not fetched
+    again (nor, with `incremental`, media already saved as this file), and a download is hashed in memory before anything is written:
+    if its bytes match a saved file it is hardlinked to it or skipped,
+    according to `dedup`, without being written at all.
+    Progress, stage timings and messages go to `instr` (an
+    Instrumentation); without one, messages are printed as before.
+    Returns DONE, DEDUPED, EXPIRED (the link died before it could be fetched) or FAILED.
+    """
+    instr = instr or Instrumentation(progress=False, verbose=True)
+    timings = {}
+    start = time.perf_counter()
+    status, size = _run_job(job, pool, manifest, store, dedup, instr, incremental, timings)
+    instr.item_done(status, size, file=job['filename'], seconds=round(time.perf_counter() - start, 4),
+                    stages=timings)
+    return status
+
+def _run_job(job, pool, manifest, store, dedup, instr, incremental, timings):
+    # The body of process_job(); returns (status, bytes written)
+    filename = job['filename']
+    filepath = job['filepath']
+    part_path = filepath + PART_SUFFIX
+    capture_dt = job['capture_dt']
+    local_dt = job['local_dt']
+
+    try:
+        if reuse_known_media(job, manifest, store, dedup, instr, incremental):
+            return DEDUPED, 0
+
+        instr.info(f"Downloading {filename}...") # Shorter log
+        exif_bytes = None
+        if capture_dt and local_dt:
+            with instr.timer('exif_build', timings):
+                exif_bytes, offset_str_exif = build_exif_bytes(capture_dt, local_dt, job['location'], job.get('times'))
+
+        # With dedup on, the photo is hashed in memory first, so a duplicate is never written to disk
+        buffered = store is not None
+        with (io.BytesIO() if buffered else open(part_path, 'wb')) as f:
+            sinks = []
+
+            def open_writer():
+                # Called again if the download has to restart from byte 0
+                f.seek(0)
+                f.truncate()
+                hasher = HashingWriter(f)
+                sink = JpegExifSplicer(hasher, exif_bytes) if exif_bytes else hasher
+                sinks[:] = [hasher, sink]
+                return sink
+
+            # Covers the network transfer and the EXIF splice + disk write streamed alongside it
+            with instr.timer('fetch', timings):
+                pool.copy_to(job['uri'], open_writer)
+                hasher, sink = sinks
+                if exif_bytes:
+                    sink.close()
+            size = f.tell()
+            data = f.getvalue() if buffered else None
+            if capture_dt and not buffered:
+                # Set through the open fd, after the last write has been flushed
+                with instr.timer('utime', timings):
+                    f.flush()
+                    set_file_times(f.fileno(), capture_dt, instr)
+        sha256 = hasher.hexdigest()
+
+        if exif_bytes:
+            if sink.spliced:
+                instr.info(tag_log_line(job, offset_str_exif))
+            else:
+                instr.warn(f"  -> Warning: {filename} is not a JPEG, saved without EXIF.")
+
+        if buffered:
+            if save_photo(job, data, sha256, manifest, store, dedup, instr, timings) == DEDUPED:
+                return DEDUPED, 0
+            return DONE, size
+
+        with instr.timer('finalize', timings):
+            os.replace(part_path, filepath)
+            if manifest is not None:
+                manifest.record(job, size, sha256)
+        return DONE, size
+    except HTTPError as e:
+        remove_quietly(part_path)
+        if e.code == 403 and is_expired(job):
+            instr.info(f"Link expired for {filename}")
+            return EXPIRED, 0
+        instr.warn(f"Failed to download {job['uri']}: {e}")
+    except Exception as e:
+        remove_quietly(part_path)
+        instr.warn(f"An error occurred with {filename}: {e}")
+    return FAILED, 0
+
+def tag_photo_bytes(job, data):
+    """
+    Splices the EXIF block into an in-memory JPEG.
+    Runs on the tag executor (possibly in another process), so it only
+    touches its arguments and hands its stage timings back.
+    Data that isn't a JPEG is passed through untagged with a warning, as
+    process_job() does.
+    Returns (tagged_bytes, log_line, warning, sha256 of the tagged bytes, timings).
+    """
+    log_line = None
+    warning = None
+    timings = {}
+    if job['capture_dt'] and job['local_dt']:
+        start = time.perf_counter()
+        exif_bytes, offset_str_exif = build_exif_bytes(job['capture_dt'], job['local_dt'], job['location'], job.get('times'))
+        built = time.perf_counter()
+        out = io.BytesIO()
+        splicer = JpegExifSplicer(out, exif_bytes)
+        splicer.write(data)
+        splicer.close()
+        timings['exif_build'] = built - start
+        timings['insert'] = time.perf_counter() - built
+        if splicer.spliced:
+            data = out.getvalue()
+            log_line = tag_log_line(job, offset_str_exif)
+        else:
+            warning = f"  -> Warning: {job['filename']} is not a JPEG, saved without EXIF."
+    return data, log_line, warning, hashlib.sha256(data).hexdigest(), timings
+
+def write_photo(job, data, instr, timings):
+    """
+    Writes a finished photo to disk via a temp file and sets its file times.
+    """
+    part_path = job['filepath'] + PART_SUFFIX
+    try:
+        with open(part_path, 'wb') as f:
+            with instr.timer('write', timings):
+                f.write(data)
+                f.flush()
+            if job['capture_dt']:
+                with instr.timer('utime', timings):
+                    set_file_times(f.fileno(), job['capture_dt'], instr)
+        os.replace(part_path, job['filepath'])
+    except BaseException:
+        remove_quietly(part_path)
+        raise
+
+def save_photo(job, data, sha256, manifest, store, dedup, instr, timings):
+    """
+    Saves a downloaded, tagged photo and records it in `manifest` and the
+    content `store`; if `store` already has these bytes, the photo is
+    hardlinked or skipped instead (see reuse_duplicate). Everything here
+    touches the disk, so the async pipeline runs it on an executor.
+    Returns DONE or DEDUPED.
+    """
+    existing_path = store.find_content(sha256) if store is not None else None
+    # The photo's own earlier copy is replaced, not reused: it may be why it was fetched again
+    if existing_path and os.path.abspath(existing_path) == os.path.abspath(job['filepath']):
+        existing_path = None
+    if existing_path and reuse_duplicate(job, existing_path, sha256, len(data), manifest, dedup, instr):
+        return DEDUPED
+    write_photo(job, data, instr, timings)
+    with instr.timer('finalize', timings):
+        if manifest is not None:
+            manifest.record(job, len(data), sha256)
+        if store is not None:
+            store.add(job, sha256, job['filepath'])
+    return DONE
+
+def retag_photo(job, instr=None):
+    """
+    Rewrites the EXIF block and file times of an already downloaded photo
+    in place, without touching its image data or the network.
+    Returns (size, sha256) of the re-tagged file, hashed as it is written.
+    """
+    exif_bytes, _ = build_exif_bytes(job['capture_dt'], job['local_dt'], job['location'], job.get('times'))
+    _, size, sha256 = write_exif(job['filepath'], exif_bytes, digest=True,
+                                 finish=lambda fd: set_file_times(fd, job['capture_dt'], instr))
+    return size, sha256
+
+def open_content_store(output_dir, dedup, dedup_store=None):
     """
-    Converts decimal coordinates to DMS (Degrees, Minutes, Seconds) tuple for EXIF.
+    Opens the content store for a run, or returns None when dedup is off.
+    `dedup_store` lets several output directories share one store.
     """
-    if value < 0:
-        loc_value = loc[1]
-    else:
-        loc_value = loc[0]
-    abs_value = abs(value)
-    deg = int(abs_value)
-    t1 = (deg, 1)
-    min_val = (abs_value - deg) * 60
-    min_int = int(min_val)
-    t2 = (min_int, 1)
-    sec_val = (min_val - min_int) * 60
-    sec = int(sec_val * 10000)
-    t3 = (sec, 10000)
-    return (t1, t2, t3), loc_value
+    if dedup not in DEDUP_MODES:
+        raise ValueError(f"Unknown dedup mode '{dedup}', expected one of: {', '.join(DEDUP_MODES)}")
+    if dedup == 'off':
+        return None
+    return ContentStore(dedup_store or os.path.join(output_dir, STORE_NAME))
 
-def download_photos(json_file_path, output_dir):
+def download_photos(json_file_path, output_dir, workers=DEFAULT_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                    incremental=True, min_remaining=DEFAULT_MIN_REMAINING, quality='medium', budget_mb=None,
+                    dedup='off', dedup_store=None, instrumentation=None, dry_run=False):
     """
     Downloads photos from a JSON file to a specified directory,
     renames them based on capture date, and updates EXIF metadata
     including GPS, Timezone, and Camera info.
+    Downloads run on `workers` threads sharing keep-alive connections,
+    with at most `per_host_limit` requests in flight per host.
+    With `incremental`, photos already recorded in the output directory's
+    manifest (same modified date or etag, file still present) are skipped, so
+    re-runs only fetch new or changed media and interrupted runs resume.
+    `json_file_path` may also be a directory or glob of all-media page
+    files; they are parsed incrementally and downloads start as soon as the
+    first encounter is read.
+    Photos are fetched soonest-expiring link first; links with less than
+    `min_remaining` seconds left are skipped and reported as expired.
+    `quality` picks the resolution tier(s) (see planner.QualityPolicy) and
+    `budget_mb` caps the run's estimated download size.
+    `dedup` ('link' or 'skip') keeps a sha256 -> path store of saved photos
+    (in the output directory, or `dedup_store` to share it between
+    libraries); photos whose content is already saved are hardlinked to
+    the existing file or not written at all.
+    Progress is shown as a periodically refreshed status line; pass an
+    `instrumentation` (see instrumentation.Instrumentation) for per-photo
+    messages, a JSON-lines event log or a Prometheus dump of stage timings.
+    With `dry_run`, nothing is downloaded or written: the output directory
+    is compared with the export and the plan printed (see sync_plan.plan_sync).
+    Returns the number of photos downloaded (or that would be).
     """
 
+    if dry_run:
+        from sync_plan import DOWNLOAD, plan_sync
+        return len(plan_sync(json_file_path, output_dir, quality, min_remaining).items[DOWNLOAD])
+
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Load Park Coordinates
-    coords_map = {}
+    # Load Park Coordinates and Timezones
+    locations = load_locations()
+    timezones = load_park_timezones()
+
+    reader = open_export(json_file_path)
+    if not reader:
+        return 0
+
+    manifest = Manifest(output_dir)
+    store = open_content_store(output_dir, dedup, dedup_store)
+    instr = instrumentation or Instrumentation()
+    stats = new_run_stats()
+    jobs = iter_export_jobs(reader, locations, output_dir, manifest, incremental, stats, min_remaining,
+                            quality_policy(quality), budget_mb, timezones)
+
+    pool = ConnectionPool(per_host_limit=per_host_limit)
     try:
-        with open('park_coordinates.json', 'r') as f:
-            coords_map = json.load(f)
-    except FileNotFoundError:
-        print("Warning: park_coordinates.json not found. GPS tagging will be skipped.")
-    except json.JSONDecodeError:
-        print("Warning: Invalid JSON in park_coordinates.json.")
+        if workers <= 1:
+            for job in jobs:
+                stats[process_job(job, pool, manifest, store, dedup, instr, incremental)] += 1
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Keep only a few jobs per worker queued so parsing stays ahead without buffering everything
+                pending = set()
+                for job in jobs:
+                    if len(pending) >= workers * 4:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            stats[future.result()] += 1
+                    pending.add(executor.submit(process_job, job, pool, manifest, store, dedup, instr, incremental))
+                for future in as_completed(pending):
+                    stats[future.result()] += 1
+    finally:
+        pool.close()
+        manifest.close()
+        if store is not None:
+            store.close()
+        instr.close()
+
+    return report_run(reader, stats)
+
+def open_run(json_file_path, output_dir, dedup='off', dedup_store=None):
+    """
+    Does a run's blocking startup: creates the output directory and loads
+    the location/timezone config, the export, the manifest and the content
+    store. Returns (locations, timezones, reader, manifest, store), or None
+    if the export can't be found.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    locations = load_locations()
+    timezones = load_park_timezones()
+    reader = open_export(json_file_path)
+    if not reader:
+        return None
+    return locations, timezones, reader, Manifest(output_dir), open_content_store(output_dir, dedup, dedup_store)
 
+async def download_photos_async(json_file_path, output_dir, fetch_workers=DEFAULT_WORKERS,
+                                tag_workers=None, finalize_workers=2, queue_size=DEFAULT_QUEUE_SIZE,
+                                per_host_limit=DEFAULT_PER_HOST_LIMIT, tag_executor=None, incremental=True,
+                                min_remaining=DEFAULT_MIN_REMAINING, quality='medium', budget_mb=None,
+                                dedup='off', dedup_store=None, instrumentation=None):
+    """
+    Asyncio version of download_photos() for embedding in other services.
+    Work flows through three stages joined by bounded queues:
+    fetch (network, thread pool) -> tag (EXIF injection, process pool by
+    default) -> finalize (write file + file times). A slow stage fills its
+    input queue and pauses the stages before it instead of buffering
+    the whole library in memory.
+    Pass `tag_executor` to reuse your own executor for the tag stage.
+    `incremental`, `min_remaining`, `quality`, `budget_mb`, `dedup` and
+    `instrumentation` work as in download_photos().
+    Returns the number of photos written.
+    """
+    loop = asyncio.get_running_loop()
+    # File reads and JSON parsing run here, off the event loop; one thread
+    # keeps the job generator from being driven concurrently
+    parse_executor = ThreadPoolExecutor(max_workers=1)
     try:
-        with open(json_file_path, 'r') as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        print(f"Error: JSON file not found at {json_file_path}")
-        return
-    except json.JSONDecodeError:
-        print(f"Error: Invalid JSON format in {json_file_path}")
-        return
+        opened = await loop.run_in_executor(parse_executor, open_run, json_file_path, output_dir, dedup,
+                                            dedup_store)
+    except BaseException:
+        parse_executor.shutdown(wait=False)
+        raise
+    if opened is None:
+        parse_executor.shutdown(wait=False)
+        return 0
+    locations, timezones, reader, manifest, store = opened
 
-    encounters = data.get('guestMedia', {}).get('encounters', [])
-    
-    if not encounters:
-        print("No encounters found in JSON.")
-        return
+    tag_workers = tag_workers or os.cpu_count() or 1
+    fetch_queue = asyncio.Queue(maxsize=queue_size)
+    tag_queue = asyncio.Queue(maxsize=queue_size)
+    finalize_queue = asyncio.Queue(maxsize=queue_size)
 
-    count = 0
-    for encounter in encounters:
-        orig_park = encounter.get('origPark')
-        encounter_coords = coords_map.get(orig_park)
-        
-        media_list = encounter.get('mediaList', [])
-        for media in media_list:
-            # Try to get the medium resolution URI first, then thumb
-            uri = media.get('mediaMedium', {}).get('uri')
-            if not uri:
-                uri = media.get('mediaThumb', {}).get('uri')
-            
-            capture_date_str = media.get('captureDate') # e.g., "2026-01-18T19:16:29Z"
-            media_id = media.get('mediaId', 'unknown')
+    pool = ConnectionPool(per_host_limit=per_host_limit)
+    fetch_executor = ThreadPoolExecutor(max_workers=fetch_workers)
+    finalize_executor = ThreadPoolExecutor(max_workers=finalize_workers)
+    own_tag_executor = tag_executor is None
+    if own_tag_executor:
+        tag_executor = ProcessPoolExecutor(max_workers=tag_workers)
+
+    instr = instrumentation or Instrumentation()
+    stats = new_run_stats()
+
+    def finish(status, job, nbytes=0, timings=None):
+        stats[status] += 1
+        instr.item_done(status, nbytes, file=job['filename'], stages=timings or {})
+
+    async def produce():
+        jobs = iter_export_jobs(reader, locations, output_dir, manifest, incremental, stats, min_remaining,
+                                quality_policy(quality), budget_mb, timezones)
+        while True:
+            job = await loop.run_in_executor(parse_executor, next, jobs, None)
+            if job is None:
+                return
+            await fetch_queue.put(job)
+
+    async def fetch_stage():
+        while True:
+            job = await fetch_queue.get()
+            try:
+                if job is None:
+                    return
+                if store is not None and await loop.run_in_executor(finalize_executor, reuse_known_media,
+                                                                    job, manifest, store, dedup, instr,
+                                                                    incremental):
+                    finish(DEDUPED, job)
+                    continue
+                instr.info(f"Downloading {job['filename']}...")
+                timings = {}
+                start = time.perf_counter()
+                data = await loop.run_in_executor(fetch_executor, pool.fetch, job['uri'])
+                instr.add_timings({'fetch': time.perf_counter() - start}, timings)
+                await tag_queue.put((job, data, timings))
+            except HTTPError as e:
+                if e.code == 403 and is_expired(job):
+                    instr.info(f"Link expired for {job['filename']}")
+                    finish(EXPIRED, job)
+                else:
+                    instr.warn(f"Failed to download {job['uri']}: {e}")
+                    finish(FAILED, job)
+            except Exception as e:
+                instr.warn(f"An error occurred with {job['filename']}: {e}")
+                finish(FAILED, job)
+            finally:
+                fetch_queue.task_done()
+
+    async def tag_stage():
+        while True:
+            item = await tag_queue.get()
+            try:
+                if item is None:
+                    return
+                job, data, timings = item
+                data, log_line, warning, sha256, tag_timings = await loop.run_in_executor(tag_executor,
+                                                                                          tag_photo_bytes, job, data)
+                instr.add_timings(tag_timings, timings)
+                if log_line:
+                    instr.info(log_line)
+                if warning:
+                    instr.warn(warning)
+                await finalize_queue.put((job, data, sha256, timings))
+            except Exception as e:
+                instr.warn(f"An error occurred with {job['filename']}: {e}")
+                finish(FAILED, job)
+            finally:
+                tag_queue.task_done()
 
-            if uri:
-                # Parse capture date and format filename
-                capture_dt = None
-                local_dt = None
-                try:
-                    # Parse URL time (Zulu)
-                    capture_dt = datetime.strptime(capture_date_str, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=ZoneInfo("UTC"))
-                    
-                    # Convert to Eastern Time
-                    local_dt = capture_dt.astimezone(ZoneInfo("America/New_York"))
-                    
-                    filename_timestamp = capture_dt.strftime("%Y-%m-%d_%H-%M-%S")
-                    filename = f"{filename_timestamp}_{media_id}.jpg"
-                except (ValueError, TypeError, Exception) as e:
-                    print(f"Warning: Could not parse date/time '{capture_date_str}' ({e}). Using ID filename.")
-                    filename = f"{media_id}.jpg"
-
-                filepath = os.path.join(output_dir, filename)
-                
-                print(f"Downloading {filename}...") # Shorter log
-                try:
-                    urllib.request.urlretrieve(uri, filepath)
-                    
-                    if capture_dt and local_dt:
-                        # Prepare EXIF data
-                        exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
-                        
-                        # Timestamp strings
-                        datetime_original_str = local_dt.strftime("%Y:%m:%d %H:%M:%S")
-                        offset_str = local_dt.strftime("%z") # +HHMM or -HHMM
-                        # Insert colon for EXIF format +/-HH:MM
-                        offset_str_exif = f"{offset_str[:-2]}:{offset_str[-2:]}"
-
-                        # 0th IFD
-                        exif_dict["0th"][piexif.ImageIFD.Make] = "Disney Photo Pass"
-                        exif_dict["0th"][piexif.ImageIFD.Model] = "Disney Photo Pass"
-                        exif_dict["0th"][piexif.ImageIFD.Software] = "Disney Photo Pass"
-                        exif_dict["0th"][piexif.ImageIFD.DateTime] = datetime_original_str.encode('utf-8')
-
-                        # Exif IFD
-                        exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal] = datetime_original_str.encode('utf-8')
-                        exif_dict["Exif"][piexif.ExifIFD.DateTimeDigitized] = datetime_original_str.encode('utf-8')
-                        exif_dict["Exif"][piexif.ExifIFD.OffsetTime] = offset_str_exif.encode('utf-8')
-                        exif_dict["Exif"][piexif.ExifIFD.OffsetTimeOriginal] = offset_str_exif.encode('utf-8')
-                        exif_dict["Exif"][piexif.ExifIFD.OffsetTimeDigitized] = offset_str_exif.encode('utf-8')
-
-                        # GPS IFD
-                        if encounter_coords:
-                            lat = encounter_coords.get('lat')
-                            lon = encounter_coords.get('lon')
-                            if lat is not None and lon is not None:
-                                gps_lat, gps_lat_ref = to_deg(lat, ["N", "S"])
-                                gps_lon, gps_lon_ref = to_deg(lon, ["E", "W"])
-                                
-                                exif_dict["GPS"][piexif.GPSIFD.GPSLatitudeRef] = gps_lat_ref.encode('utf-8')
-                                exif_dict["GPS"][piexif.GPSIFD.GPSLatitude] = gps_lat
-                                exif_dict["GPS"][piexif.GPSIFD.GPSLongitudeRef] = gps_lon_ref.encode('utf-8')
-                                exif_dict["GPS"][piexif.GPSIFD.GPSLongitude] = gps_lon
-                                
-                                # GPS Timestamp (UTC)
-                                gps_time = (
-                                    (capture_dt.hour, 1),
-                                    (capture_dt.minute, 1),
-                                    (capture_dt.second, 1)
-                                )
-                                exif_dict["GPS"][piexif.GPSIFD.GPSTimeStamp] = gps_time
-                                exif_dict["GPS"][piexif.GPSIFD.GPSDateStamp] = capture_dt.strftime("%Y:%m:%d").encode('utf-8')
-
-                        exif_bytes = piexif.dump(exif_dict)
-                        piexif.insert(exif_bytes, filepath)
-                        
-                        log_extras = []
-                        if encounter_coords: log_extras.append(f"GPS:{orig_park}")
-                        log_extras.append(f"Time:{local_dt} ({offset_str_exif})")
-                        print(f"  -> Tagged {filename} [{' '.join(log_extras)}]")
-                        
-                        # Update File System Timestamps (Modified and Created)
-                        try:
-                            ts = capture_dt.timestamp()
-                            # Set Access and Modified Time
-                            os.utime(filepath, (ts, ts))
-                            # Set Creation Time (Windows)
-                            set_creation_time(filepath, ts)
-                        except Exception as e:
-                            print(f"  -> Warning: Could not set file timestamps: {e}")
-
-                    count += 1
-                except HTTPError as e:
-                    print(f"Failed to download {uri}: {e}")
-                except Exception as e:
-                    print(f"An error occurred with {filename}: {e}")
-
-    print(f"Download complete. {count} photos processed.")
+    async def finalize_stage():
+        while True:
+            item = await finalize_queue.get()
+            try:
+                if item is None:
+                    return
+                job, data, sha256, timings = item
+                status = await loop.run_in_executor(finalize_executor, save_photo, job, data, sha256, manifest,
+                                                    store, dedup, instr, timings)
+                finish(status, job, len(data) if status == DONE else 0, timings)
+            except Exception as e:
+                instr.warn(f"An error occurred with {job['filename']}: {e}")
+                finish(FAILED, job)
+            finally:
+                finalize_queue.task_done()
+
+    async def run_stage(worker, n, next_queue, n_next):
+        # Once every worker of a stage has drained, tell the next stage to stop
+        await asyncio.gather(*(worker() for _ in range(n)))
+        if next_queue is not None:
+            for _ in range(n_next):
+                await next_queue.put(None)
+
+    async def run_producer():
+        await produce()
+        for _ in range(fetch_workers):
+            await fetch_queue.put(None)
+
+    stages = [asyncio.create_task(stage) for stage in (
+        run_producer(),
+        run_stage(fetch_stage, fetch_workers, tag_queue, tag_workers),
+        run_stage(tag_stage, tag_workers, finalize_queue, finalize_workers),
+        run_stage(finalize_stage, finalize_workers, None, 0),
+    )]
+    try:
+        await asyncio.gather(*stages)
+    finally:
+        # If one stage failed, the others would wait on their queues forever
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+        parse_executor.shutdown(wait=False)
+        fetch_executor.shutdown(wait=False)
+        finalize_executor.shutdown(wait=True)
+        if own_tag_executor:
+            tag_executor.shutdown(wait=True)
+        pool.close()
+        manifest.close()
+        if store is not None:
+            store.close()
+        instr.close()
+
+    return report_run(reader, stats)
+
+def estimate_downloads(json_file_path, quality='medium'):
+    """
+    Parses an export without downloading anything and prints how many
+    photos each tier would fetch and their estimated total size.
+    Returns the estimated total bytes.
+    """
+    reader = open_export(json_file_path)
+    if not reader:
+        return 0
+    totals = {}
+    for job in build_jobs(reader, None, "", quality_policy(quality)):
+        count, size = totals.get(job['tier'], (0, 0))
+        totals[job['tier']] = (count + 1, size + job['est_bytes'])
+    total_bytes = 0
+    for tier, (count, size) in sorted(totals.items()):
+        print(f"{tier}: {count} photos, ~{size / (1024 * 1024):.1f} MB")
+        total_bytes += size
+    print(f"Total: ~{total_bytes / (1024 * 1024):.1f} MB")
+    return total_bytes
 
 if __name__ == "__main__":
-    json_file = "photos.json"
-    download_dir = "downloaded_photos"
-    download_photos(json_file, download_dir)
+    # Same as batch.py: photos.json -> downloaded_photos by default, or several exports / accounts
+    from batch import main
+    main()
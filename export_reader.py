@@ -0,0 +1,185 @@
+import glob
+import json
+import os
+import re
+
+READ_SIZE = 1024 * 1024
+
+class JsonStream:
+    """
+    Minimal pull parser over a text file. Walks objects and arrays one
+    key/element at a time and decodes individual values with
+    json.JSONDecoder.raw_decode, so only the value being read has to fit in memory.
+    """
+
+    def __init__(self, f, read_size=READ_SIZE):
+        self.f = f
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size):
+        if self.eof:
+            return False
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character ('' at end of file).
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill(self.read_size):
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def read_value(self):
+        """
+        Decodes and returns the next complete JSON value.
+        """
+        self.peek()
+        size = self.read_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number or literal at the very end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Value spans past the buffer; read more, growing the reads so big values stay linear
+            self._fill(size)
+            size *= 2
+
+    def object_keys(self):
+        """
+        Iterates the keys of the object at the current position. After each
+        key is yielded the caller must consume its value (read_value or a
+        nested walk) before asking for the next one.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def array_items(self):
+        """
+        Iterates the elements of the array at the current position. The caller
+        consumes each element after it is yielded.
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+def _natural_key(path):
+    # page2.json sorts before page10.json
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+def export_files(source):
+    """
+    Resolves an export source to a list of JSON files: a single file,
+    every *.json file in a directory, or a glob pattern.
+    """
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, "*.json"))
+    elif glob.has_magic(source):
+        paths = glob.glob(source)
+    else:
+        paths = [source] if os.path.exists(source) else []
+    return sorted(paths, key=_natural_key)
+
+def iter_file_encounters(path, read_size=READ_SIZE):
+    """
+    Yields each guestMedia.encounters entry of one all-media page, one at a time.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = JsonStream(f, read_size)
+        for key in stream.object_keys():
+            if key != 'guestMedia' or stream.peek() != "{":
+                stream.read_value()
+                continue
+            for media_key in stream.object_keys():
+                if media_key != 'encounters' or stream.peek() != "[":
+                    stream.read_value()
+                    continue
+                for _ in stream.array_items():
+                    yield stream.read_value()
+
+class ExportReader:
+    """
+    Incrementally reads one or more all-media exports (a file, a directory
+    of page files, or a glob) and yields encounters as they are parsed.
+    Pages are merged in natural filename order; a mediaId already seen in an
+    earlier page or encounter is dropped, and encounters left empty are skipped.
+    """
+
+    def __init__(self, source, read_size=READ_SIZE):
+        self.source = source
+        self.read_size = read_size
+        self.files = export_files(source)
+        self.encounter_count = 0
+        self.media_count = 0
+
+    def encounters(self):
+        seen_media = set()
+        for path in self.files:
+            for encounter in iter_file_encounters(path, self.read_size):
+                media_list = []
+                for media in encounter.get('mediaList') or []:
+                    media_id = media.get('mediaId')
+                    if media_id is not None:
+                        if media_id in seen_media:
+                            continue
+                        seen_media.add(media_id)
+                    media_list.append(media)
+                if not media_list and encounter.get('mediaList'):
+                    continue
+                encounter['mediaList'] = media_list
+                self.encounter_count += 1
+                self.media_count += len(media_list)
+                yield encounter
+
+    def media(self):
+        """
+        Yields (encounter, media) pairs one by one.
+        """
+        for encounter in self.encounters():
+            for media in encounter['mediaList']:
+                yield encounter, media
+
+    def __iter__(self):
+        return self.encounters()
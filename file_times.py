@@ -0,0 +1,168 @@
+import os
+import platform
+from datetime import datetime, timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# FILETIME counts 100ns ticks since 1601-01-01
+FILETIME_EPOCH_OFFSET = 116444736000000000
+
+FILE_WRITE_ATTRIBUTES = 0x0100
+FILE_SHARE_ALL = 0x07
+OPEN_EXISTING = 3
+FILE_ATTRIBUTE_NORMAL = 0x80
+FILE_FLAG_BACKUP_SEMANTICS = 0x02000000
+
+IS_WINDOWS = platform.system() == 'Windows'
+UTIME_FD = os.utime in os.supports_fd
+UTIME_DIR_FD = os.utime in os.supports_dir_fd
+
+_win32 = None
+
+def to_ns(value):
+    """
+    Converts an aware datetime or a POSIX timestamp in seconds to integer nanoseconds.
+    """
+    if isinstance(value, datetime):
+        delta = value - EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+    return int(round(value * 1_000_000_000))
+
+def created_ns(stat_result):
+    """
+    Returns a file's creation (birth) time in nanoseconds from an os.stat()
+    result, or None where the platform doesn't report one.
+    """
+    ns = getattr(stat_result, 'st_birthtime_ns', None)
+    if ns is None and getattr(stat_result, 'st_birthtime', None) is not None:
+        ns = to_ns(stat_result.st_birthtime)
+    if ns is None and IS_WINDOWS:
+        # Before Python 3.12, st_ctime is the creation time on Windows
+        ns = stat_result.st_ctime_ns
+    return ns
+
+class _Win32:
+    """
+    kernel32 functions with their signatures declared, built once per process.
+    """
+
+    def __init__(self):
+        import ctypes
+        import msvcrt
+        from ctypes import wintypes
+
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        self.CreateFileW = kernel32.CreateFileW
+        self.CreateFileW.restype = wintypes.HANDLE
+        self.CreateFileW.argtypes = [
+            wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD,
+            wintypes.LPVOID, wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE
+        ]
+        self.SetFileTime = kernel32.SetFileTime
+        self.SetFileTime.restype = wintypes.BOOL
+        self.SetFileTime.argtypes = [
+            wintypes.HANDLE, ctypes.POINTER(wintypes.FILETIME),
+            ctypes.POINTER(wintypes.FILETIME), ctypes.POINTER(wintypes.FILETIME)
+        ]
+        self.CloseHandle = kernel32.CloseHandle
+        self.CloseHandle.argtypes = [wintypes.HANDLE]
+        self.INVALID_HANDLE_VALUE = wintypes.HANDLE(-1).value
+        self.FILETIME = wintypes.FILETIME
+        self.byref = ctypes.byref
+        self.get_osfhandle = msvcrt.get_osfhandle
+        self.WinError = ctypes.WinError
+        self.get_last_error = ctypes.get_last_error
+
+    def filetime(self, ns):
+        if ns is None:
+            return None
+        t = ns // 100 + FILETIME_EPOCH_OFFSET
+        return self.byref(self.FILETIME(t & 0xFFFFFFFF, t >> 32))
+
+    def set_times(self, handle, creation_ns, accessed_ns, modified_ns):
+        # One call sets all three; None leaves that time alone
+        if not self.SetFileTime(handle, self.filetime(creation_ns), self.filetime(accessed_ns),
+                                self.filetime(modified_ns)):
+            raise self.WinError(self.get_last_error())
+
+    def open(self, path):
+        handle = self.CreateFileW(path, FILE_WRITE_ATTRIBUTES, FILE_SHARE_ALL, None, OPEN_EXISTING,
+                                  FILE_ATTRIBUTE_NORMAL | FILE_FLAG_BACKUP_SEMANTICS, None)
+        if handle == self.INVALID_HANDLE_VALUE:
+            raise self.WinError(self.get_last_error())
+        return handle
+
+def win32():
+    """
+    Returns the shared _Win32 bindings, loading them on first use.
+    """
+    global _win32
+    if _win32 is None:
+        _win32 = _Win32()
+    return _win32
+
+def set_times(target, modified_ns, accessed_ns=None, creation_ns=None):
+    """
+    Sets a file's modified and access times (and its creation time on
+    Windows) with nanosecond precision. `target` is a path or, better, the
+    fd of a file that is still open, which saves a path lookup; flush
+    anything buffered first, or the final write bumps the modified time.
+    `accessed_ns` defaults to `modified_ns`, and so does `creation_ns` on
+    Windows. Linux has no way to set a birth time, and macOS moves it back
+    on its own when the modified time is set earlier.
+    Raises OSError on failure.
+    """
+    accessed_ns = modified_ns if accessed_ns is None else accessed_ns
+    if IS_WINDOWS:
+        creation_ns = modified_ns if creation_ns is None else creation_ns
+        bindings = win32()
+        if isinstance(target, int):
+            bindings.set_times(bindings.get_osfhandle(target), creation_ns, accessed_ns, modified_ns)
+            return
+        handle = bindings.open(target)
+        try:
+            bindings.set_times(handle, creation_ns, accessed_ns, modified_ns)
+        finally:
+            bindings.CloseHandle(handle)
+        return
+    if isinstance(target, int) and not UTIME_FD:
+        raise OSError("Setting file times through a file descriptor isn't supported here.")
+    os.utime(target, ns=(accessed_ns, modified_ns))
+
+def set_times_many(items):
+    """
+    Finalizes the times of many files at once, e.g. at the end of a run.
+    `items` yields (path, modified_ns) or (path, modified_ns, accessed_ns,
+    creation_ns) tuples. Where the OS allows it, each directory is opened
+    once and files are updated relative to it, so a long path isn't looked
+    up again for every file.
+    Returns a list of (path, error) for the files that failed.
+    """
+    by_dir = {}
+    for item in items:
+        path = item[0]
+        by_dir.setdefault(os.path.dirname(path), []).append(item)
+
+    failed = []
+    for directory, entries in by_dir.items():
+        dir_fd = None
+        if UTIME_DIR_FD and not IS_WINDOWS:
+            try:
+                dir_fd = os.open(directory or ".", os.O_RDONLY)
+            except OSError:
+                dir_fd = None
+        try:
+            for path, modified_ns, *rest in entries:
+                accessed = rest[0] if rest and rest[0] is not None else modified_ns
+                created = rest[1] if len(rest) > 1 else None
+                try:
+                    if dir_fd is not None:
+                        os.utime(os.path.basename(path), ns=(accessed, modified_ns), dir_fd=dir_fd)
+                    else:
+                        set_times(path, modified_ns, accessed, created)
+                except OSError as e:
+                    failed.append((path, e))
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+    return failed
@@ -0,0 +1,236 @@
+import http.client
+import io
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, urljoin
+
+CHUNK_SIZE = 64 * 1024
+MAX_REDIRECTS = 5
+
+# Retries for throttling (429), server errors and dropped connections
+DEFAULT_RETRIES = 5
+# Base delay in seconds; doubles each attempt, with full jitter, up to MAX_BACKOFF
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, http.client.IncompleteRead, http.client.BadStatusLine)
+
+def is_transient(error):
+    """
+    True for errors worth retrying: throttling, 5xx and connection failures.
+    """
+    if isinstance(error, HTTPError):
+        return error.code in RETRY_STATUSES
+    return isinstance(error, TRANSIENT_ERRORS)
+
+def retry_delay(error, attempt, backoff=DEFAULT_BACKOFF):
+    """
+    Seconds to wait before retry number `attempt`: the server's Retry-After
+    when it sends one, otherwise jittered exponential backoff.
+    """
+    if isinstance(error, HTTPError) and error.headers is not None:
+        retry_after = error.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), MAX_BACKOFF)
+    return random.uniform(0, min(MAX_BACKOFF, backoff * 2 ** attempt))
+
+class Transfer:
+    """
+    Progress of one download across retries: the current writer and how
+    many body bytes it has received.
+    """
+
+    def __init__(self, open_writer):
+        self.open_writer = open_writer
+        self.restart()
+
+    def restart(self):
+        self.writer = self.open_writer()
+        self.received = 0
+
+    def write(self, chunk):
+        self.writer.write(chunk)
+        self.received += len(chunk)
+
+class ConnectionPool:
+    """
+    Keeps one persistent (keep-alive) HTTP/HTTPS connection per host per
+    worker thread, so repeated downloads from the same S3 bucket reuse the
+    TLS session instead of reconnecting for every photo.
+    Also caps how many requests may be in flight to a single host at once.
+    """
+
+    def __init__(self, per_host_limit=4, timeout=60, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._all_connections = []
+
+    def _host_slot(self, netloc):
+        with self._lock:
+            slot = self._host_slots.get(netloc)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_slots[netloc] = slot
+            return slot
+
+    def _connections(self):
+        conns = getattr(self._local, 'connections', None)
+        if conns is None:
+            conns = {}
+            self._local.connections = conns
+        return conns
+
+    def _get_connection(self, scheme, netloc):
+        conns = self._connections()
+        key = (scheme, netloc)
+        conn = conns.get(key)
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            conns[key] = conn
+            with self._lock:
+                self._all_connections.append(conn)
+        return conn
+
+    def _drop_connection(self, scheme, netloc):
+        conn = self._connections().pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+            with self._lock:
+                if conn in self._all_connections:
+                    self._all_connections.remove(conn)
+
+    def _send(self, url, headers):
+        """
+        Sends a GET on this thread's connection for the URL's host.
+        A kept-alive connection the server already closed is retried once on a fresh one.
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        for attempt in range(2):
+            conn = self._get_connection(parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=headers)
+                return conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self._drop_connection(parts.scheme, parts.netloc)
+                if attempt:
+                    raise
+            except Exception:
+                self._drop_connection(parts.scheme, parts.netloc)
+                raise
+
+    @contextmanager
+    def open(self, url, headers=None):
+        """
+        Opens a GET request and yields the response once it is 2xx.
+        Redirects are followed; other statuses raise HTTPError like urllib does.
+        The response body must be read to the end inside the block so the
+        connection can be reused.
+        """
+        request_headers = {'Accept-Encoding': 'identity', 'User-Agent': 'photopass-downloader'}
+        if headers:
+            request_headers.update(headers)
+
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            with self._host_slot(parts.netloc):
+                response = self._send(url, request_headers)
+                if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                    response.read()
+                    url = urljoin(url, response.getheader('Location'))
+                    continue
+                if response.status >= 400:
+                    response.read()
+                    raise HTTPError(url, response.status, response.reason, response.headers, None)
+                try:
+                    yield response
+                except Exception:
+                    # Body may be half read, so the connection can't be reused
+                    self._drop_connection(parts.scheme, parts.netloc)
+                    raise
+                if response.will_close:
+                    self._drop_connection(parts.scheme, parts.netloc)
+                return
+        raise HTTPError(url, 310, "Too many redirects", None, None)
+
+    def _copy_from(self, url, transfer, chunk_size):
+        """
+        One attempt at streaming the body into the transfer, asking for a
+        Range from the first missing byte when part of it already arrived.
+        """
+        headers = {'Range': f"bytes={transfer.received}-"} if transfer.received else None
+        with self.open(url, headers) as response:
+            if transfer.received:
+                content_range = response.getheader('Content-Range') or ""
+                if response.status != 206 or not content_range.startswith(f"bytes {transfer.received}-"):
+                    # Server sent the whole body again; start over
+                    transfer.restart()
+            length = response.getheader('Content-Length')
+            expected = transfer.received + int(length) if length and length.isdigit() else None
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                transfer.write(chunk)
+            if expected is not None and transfer.received < expected:
+                raise http.client.IncompleteRead(b"", expected - transfer.received)
+
+    def copy_to(self, url, open_writer, chunk_size=CHUNK_SIZE):
+        """
+        Streams a URL's body into the file-like writer returned by
+        open_writer(). Transient failures are retried with jittered
+        exponential backoff; a transfer cut off partway resumes with a
+        Range request from the last byte received. If the server ignores the
+        Range, open_writer() is called again and the body starts over, so
+        it must return a fresh, empty writer each time.
+        Returns (writer, number of bytes received).
+        """
+        transfer = Transfer(open_writer)
+        attempt = 0
+        while True:
+            try:
+                self._copy_from(url, transfer, chunk_size)
+                return transfer.writer, transfer.received
+            except (HTTPError,) + TRANSIENT_ERRORS as e:
+                # 416: our offset is past what the server has, so restart from scratch
+                out_of_range = isinstance(e, HTTPError) and e.code == 416 and transfer.received
+                if attempt >= self.retries or not (out_of_range or is_transient(e)):
+                    raise
+                if out_of_range:
+                    transfer.restart()
+                time.sleep(retry_delay(e, attempt, self.backoff))
+                attempt += 1
+
+    def fetch(self, url):
+        """
+        Downloads a URL into memory (with retries) and returns the body bytes.
+        """
+        buffer, _ = self.copy_to(url, io.BytesIO)
+        return buffer.getvalue()
+
+    def close(self):
+        """
+        Closes every connection opened by any worker thread.
+        """
+        with self._lock:
+            conns = self._all_connections
+            self._all_connections = []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
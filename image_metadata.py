@@ -0,0 +1,365 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+from manifest import HashingWriter
+
+SOI = b"\xff\xd8"
+APP0 = 0xE0
+APP1 = 0xE1
+EXIF_HEADER = b"Exif\x00\x00"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+COPY_SIZE = 1024 * 1024
+
+class JpegExifSplicer:
+    """
+    File-like writer that splices an EXIF APP1 segment into a JPEG while it
+    streams through, so a downloaded photo can be tagged on its way to disk
+    instead of being written, read back and rewritten by piexif.insert.
+
+    Like piexif.insert, any leading JFIF APP0 and existing EXIF APP1 segments
+    are replaced by the new one; everything from the first other segment on
+    is passed through untouched.
+    Data that does not start with a JPEG SOI marker is passed through as-is
+    and `spliced` stays False.
+    """
+
+    def __init__(self, out, exif_bytes):
+        self._out = out
+        exif_bytes = _with_exif_header(exif_bytes)
+        self._app1 = b"\xff\xe1" + struct.pack(">H", len(exif_bytes) + 2) + exif_bytes
+        self._buffer = b""
+        self._skip = 0
+        self._state = 'soi'
+        self.spliced = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _emit(self, data):
+        if data:
+            self._out.write(data)
+            self.bytes_out += len(data)
+
+    def write(self, chunk):
+        self.bytes_in += len(chunk)
+        if self._state == 'body':
+            self._emit(chunk)
+            return len(chunk)
+
+        data = self._buffer + chunk
+        self._buffer = b""
+        pos = 0
+
+        if self._state == 'soi':
+            if len(data) < 2:
+                self._buffer = data
+                return len(chunk)
+            if data[:2] != SOI:
+                self._state = 'body'
+                self._emit(data)
+                return len(chunk)
+            self._emit(SOI + self._app1)
+            self.spliced = True
+            self._state = 'header'
+            pos = 2
+
+        while self._state == 'header':
+            if self._skip:
+                step = min(self._skip, len(data) - pos)
+                self._skip -= step
+                pos += step
+                if self._skip:
+                    break
+                continue
+            if len(data) - pos < 10:
+                self._buffer = data[pos:]
+                return len(chunk)
+            marker = data[pos + 1]
+            length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+            is_jfif = marker == APP0
+            is_exif = marker == APP1 and data[pos + 4:pos + 10] == EXIF_HEADER
+            if data[pos] == 0xFF and (is_jfif or is_exif):
+                self._skip = length + 2
+            else:
+                self._state = 'body'
+
+        self._emit(data[pos:])
+        return len(chunk)
+
+    def close(self):
+        """
+        Flushes anything still buffered. Raises ValueError if the stream
+        ended inside the JPEG header.
+        """
+        if self._state != 'body' and (self._buffer or self._skip):
+            if self._state == 'soi':
+                self._emit(self._buffer)
+                self._buffer = b""
+                return
+            raise ValueError("JPEG data ended inside its header segments.")
+        self._emit(self._buffer)
+        self._buffer = b""
+
+def splice_exif(data, exif_bytes):
+    """
+    Returns an in-memory JPEG with its EXIF replaced by `exif_bytes`.
+    """
+    out = io.BytesIO()
+    splicer = JpegExifSplicer(out, exif_bytes)
+    splicer.write(data)
+    splicer.close()
+    if not splicer.spliced:
+        raise ValueError("Given data isn't JPEG.")
+    return out.getvalue()
+
+def read_jpeg_exif(f):
+    """
+    Reads the EXIF payload ("Exif\x00\x00..." as Pillow's info['exif'] returns it)
+    from an open JPEG by walking only its header segments, seeking over
+    everything else. Stops at the start of the image data.
+    Returns None if the file has no EXIF segment.
+    """
+    if f.read(2) != SOI:
+        return None
+    while True:
+        header = f.read(2)
+        if len(header) < 2 or header[0] != 0xFF:
+            return None
+        marker = header[1]
+        # Fill bytes before a marker
+        while marker == 0xFF:
+            byte = f.read(1)
+            if not byte:
+                return None
+            marker = byte[0]
+        # Standalone markers carry no length
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            continue
+        # Start of scan / end of image: no more metadata segments
+        if marker in (0xDA, 0xD9):
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker == APP1 and length >= 8:
+            payload = f.read(length - 2)
+            if payload[:6] == EXIF_HEADER:
+                return payload
+        else:
+            f.seek(length - 2, 1)
+
+def read_exif(path):
+    """
+    Returns the raw EXIF bytes of an image file, or None if it has none.
+    JPEGs are read header-only; other formats fall back to Pillow.
+    """
+    with open(path, 'rb') as f:
+        if f.read(2) == SOI:
+            f.seek(0)
+            return read_jpeg_exif(f)
+
+    from PIL import Image
+    with Image.open(path) as img:
+        return img.info.get('exif')
+
+def _with_exif_header(exif_bytes):
+    # A JPEG APP1 segment needs the header that PNG/WebP sources come without
+    if exif_bytes.startswith(EXIF_HEADER):
+        return exif_bytes
+    return EXIF_HEADER + exif_bytes
+
+def _strip_exif_header(exif_bytes):
+    # PNG eXIf and WebP EXIF chunks hold the bare TIFF structure
+    if exif_bytes.startswith(EXIF_HEADER):
+        return exif_bytes[len(EXIF_HEADER):]
+    return exif_bytes
+
+def _copy_bytes(src, dst, length):
+    while length > 0:
+        chunk = src.read(min(COPY_SIZE, length))
+        if not chunk:
+            raise ValueError("Unexpected end of file.")
+        dst.write(chunk)
+        length -= len(chunk)
+
+def _rewrite(path, transform, digest=False, finish=None):
+    """
+    Streams `path` through transform(src, dst) into a temp file next to it,
+    then atomically replaces the original.
+    With `digest`, the output is hashed on its way out and (size, sha256)
+    returned, so callers don't need to read the new file back.
+    `finish` is called with the temp file's fd once everything is written
+    and flushed, before it is closed and renamed into place, e.g. to set
+    its file times without another path lookup.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".exif-", suffix=".tmp")
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            out = HashingWriter(dst) if digest else dst
+            transform(src, out)
+            if finish is not None:
+                dst.flush()
+                finish(dst.fileno())
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+        return (out.size, out.hexdigest()) if digest else None
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _png_transform(exif_bytes):
+    payload = _strip_exif_header(exif_bytes)
+    exif_chunk = (struct.pack(">I", len(payload)) + b"eXIf" + payload
+                  + struct.pack(">I", zlib.crc32(b"eXIf" + payload) & 0xFFFFFFFF))
+
+    def transform(src, dst):
+        if src.read(8) != PNG_SIGNATURE:
+            raise ValueError("Given data isn't PNG.")
+        dst.write(PNG_SIGNATURE)
+        while True:
+            header = src.read(8)
+            if len(header) < 8:
+                raise ValueError("PNG ended before IDAT.")
+            length, chunk_type = struct.unpack(">I4s", header)
+            if chunk_type == b"eXIf":
+                src.seek(length + 4, 1)
+                continue
+            if chunk_type in (b"IDAT", b"IEND"):
+                # eXIf must come before the image data; the rest is copied as-is
+                dst.write(exif_chunk)
+                dst.write(header)
+                shutil.copyfileobj(src, dst, COPY_SIZE)
+                return
+            dst.write(header)
+            _copy_bytes(src, dst, length + 4)
+    return transform
+
+def write_png_exif(path, exif_bytes, digest=False, finish=None):
+    """
+    Inserts or replaces the eXIf chunk of a PNG without touching pixel data.
+    """
+    return _rewrite(path, _png_transform(exif_bytes), digest, finish)
+
+def _webp_canvas_size(chunk_type, data):
+    """
+    Reads (width, height, has_alpha) from a simple-format VP8/VP8L bitstream header.
+    """
+    if chunk_type == b"VP8 " and data[3:6] == b"\x9d\x01\x2a":
+        width = struct.unpack("<H", data[6:8])[0] & 0x3FFF
+        height = struct.unpack("<H", data[8:10])[0] & 0x3FFF
+        return width, height, False
+    if chunk_type == b"VP8L" and data[:1] == b"\x2f":
+        bits = struct.unpack("<I", data[1:5])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, bool(bits >> 28 & 1)
+    raise ValueError("Unsupported WebP bitstream.")
+
+def _webp_transform(exif_bytes):
+    payload = _strip_exif_header(exif_bytes)
+    exif_chunk = b"EXIF" + struct.pack("<I", len(payload)) + payload + (b"\x00" if len(payload) % 2 else b"")
+
+    def transform(src, dst):
+        header = src.read(12)
+        if header[:4] != b"RIFF" or header[8:12] != b"WEBP":
+            raise ValueError("Given data isn't WebP.")
+
+        # Walk the chunk headers first; only small header chunks are read into memory
+        chunks = []
+        while True:
+            chunk_header = src.read(8)
+            if len(chunk_header) < 8:
+                break
+            chunk_type, size = struct.unpack("<4sI", chunk_header)
+            padded = size + (size % 2)
+            offset = src.tell()
+            data = None
+            if chunk_type == b"VP8X" or (chunk_type in (b"VP8 ", b"VP8L") and not chunks):
+                data = src.read(min(padded, 30))
+            src.seek(offset + padded)
+            if chunk_type != b"EXIF":
+                chunks.append((chunk_type, size, offset, data))
+
+        out_chunks = []
+        if chunks and chunks[0][0] == b"VP8X":
+            vp8x = bytearray(chunks[0][3][:10])
+            vp8x[0] |= 0x08
+            out_chunks.append(b"VP8X" + struct.pack("<I", 10) + bytes(vp8x))
+            chunks = chunks[1:]
+        elif chunks:
+            # Simple format: EXIF needs an extended-format VP8X header
+            width, height, has_alpha = _webp_canvas_size(chunks[0][0], chunks[0][3])
+            flags = 0x08 | (0x10 if has_alpha else 0)
+            vp8x = (bytes([flags, 0, 0, 0]) + (width - 1).to_bytes(3, 'little')
+                    + (height - 1).to_bytes(3, 'little'))
+            out_chunks.append(b"VP8X" + struct.pack("<I", 10) + vp8x)
+        else:
+            raise ValueError("WebP has no image data.")
+
+        # EXIF goes after the image data and before XMP
+        insert_at = len(chunks)
+        for i, (chunk_type, _, _, _) in enumerate(chunks):
+            if chunk_type == b"XMP ":
+                insert_at = i
+                break
+
+        body = sum(len(c) for c in out_chunks) + len(exif_chunk)
+        body += sum(8 + size + (size % 2) for _, size, _, _ in chunks)
+        dst.write(b"RIFF" + struct.pack("<I", 4 + body) + b"WEBP")
+        for chunk in out_chunks:
+            dst.write(chunk)
+        for i, (chunk_type, size, offset, _) in enumerate(chunks):
+            if i == insert_at:
+                dst.write(exif_chunk)
+            dst.write(chunk_type + struct.pack("<I", size))
+            src.seek(offset)
+            _copy_bytes(src, dst, size + (size % 2))
+        if insert_at == len(chunks):
+            dst.write(exif_chunk)
+    return transform
+
+def write_webp_exif(path, exif_bytes, digest=False, finish=None):
+    """
+    Inserts or replaces the EXIF chunk of a WebP's RIFF container without
+    re-encoding. Simple (VP8/VP8L-only) files are upgraded to the extended
+    format with a VP8X header, as the spec requires for metadata.
+    """
+    return _rewrite(path, _webp_transform(exif_bytes), digest, finish)
+
+def _jpeg_transform(exif_bytes):
+    def transform(src, dst):
+        splicer = JpegExifSplicer(dst, exif_bytes)
+        while True:
+            chunk = src.read(COPY_SIZE)
+            if not chunk:
+                break
+            splicer.write(chunk)
+        splicer.close()
+        if not splicer.spliced:
+            raise ValueError("Given data isn't JPEG.")
+    return transform
+
+def write_exif(path, exif_bytes, digest=False, finish=None):
+    """
+    Writes EXIF into a JPEG, PNG or WebP file in place, at the container
+    level (no decode/re-encode). Returns the format name that was written,
+    or (format name, size, sha256 of the new file) with `digest`.
+    `finish(fd)` runs on the new file while it is still open (see _rewrite).
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(12)
+    if magic[:2] == SOI:
+        image_format, written = "JPEG", _rewrite(path, _jpeg_transform(exif_bytes), digest, finish)
+    elif magic[:8] == PNG_SIGNATURE:
+        image_format, written = "PNG", write_png_exif(path, exif_bytes, digest, finish)
+    elif magic[:4] == b"RIFF" and magic[8:12] == b"WEBP":
+        image_format, written = "WebP", write_webp_exif(path, exif_bytes, digest, finish)
+    else:
+        raise ValueError("Unsupported image format.")
+    return (image_format,) + written if digest else image_format
@@ -0,0 +1,242 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRIC_PREFIX = "photopass"
+
+class StageTimer:
+    """
+    Running count / total / max and bucket counts for one stage's durations.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(STAGE_BUCKETS)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(STAGE_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q):
+        """
+        Estimates a quantile from the buckets (the upper bound of the bucket it falls in).
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(STAGE_BUCKETS, self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+class Instrumentation:
+    """
+    Collects what a download or copy_exif run is doing: per-stage timers
+    (fetch, exif_build, insert, utime, ...), counters (photos by status,
+    bytes), and per-photo events.
+
+    - The console gets a progress line refreshed at most every `interval`
+      seconds instead of a line per photo; per-photo messages are only
+      printed with `verbose`. Warnings are always printed.
+    - `event_log` (a path) receives every event as a JSON line.
+    - `prometheus_path` receives a Prometheus text-format dump of the
+      counters and stage timers when the run finishes.
+    Safe to share between threads. Work done in other processes reports its
+    timings back as a dict and is merged with add_timings().
+    """
+
+    def __init__(self, progress=True, verbose=False, interval=1.0, event_log=None, prometheus_path=None,
+                 stream=None, unit="photos"):
+        self.progress = progress
+        self.verbose = verbose
+        self.interval = interval
+        self.prometheus_path = prometheus_path
+        self.stream = stream or sys.stderr
+        self.unit = unit
+        self.total = None
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._last_draw = self._started
+        self._line_open = False
+        self._tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self._log = open(event_log, 'a', encoding='utf-8') if event_log else None
+
+    @contextlib.contextmanager
+    def timer(self, stage, timings=None):
+        """
+        Times the enclosed block as `stage`. When a `timings` dict is given
+        the duration is also added to it, for the photo's own event.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(stage, seconds)
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + seconds
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            timer = self.stages.get(stage)
+            if timer is None:
+                timer = self.stages[stage] = StageTimer()
+            timer.observe(seconds)
+
+    def add_timings(self, timings, into=None):
+        """
+        Merges a {stage: seconds} dict measured elsewhere (e.g. in a worker process).
+        """
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+            if into is not None:
+                into[stage] = into.get(stage, 0.0) + seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set_total(self, total):
+        self.total = total
+
+    def event(self, kind, **fields):
+        if self._log is None:
+            return
+        fields = dict(event=kind, t=round(time.time(), 3), **fields)
+        line = json.dumps(fields, default=str) + "\n"
+        with self._lock:
+            self._log.write(line)
+
+    def info(self, message):
+        """
+        Per-photo chatter: printed only when verbose, always logged.
+        """
+        self.event('log', level='info', message=message)
+        if self.verbose:
+            self._print(message)
+
+    def warn(self, message):
+        self.event('log', level='warning', message=message)
+        self._print(message)
+
+    def _print(self, message):
+        with self._lock:
+            if self._line_open:
+                self.stream.write("\r\033[K")
+                self._line_open = False
+        print(message)
+
+    def item_done(self, status, nbytes=0, **fields):
+        """
+        Counts one finished photo under `status` and refreshes the progress
+        line if it is due.
+        """
+        self.count(status)
+        if nbytes:
+            self.count('bytes', nbytes)
+        self.event('item', status=status, bytes=nbytes, **fields)
+        if self.progress:
+            now = time.perf_counter()
+            if now - self._last_draw >= self.interval:
+                self._last_draw = now
+                self._draw()
+
+    def done_count(self):
+        return sum(n for name, n in self.counters.items() if name != 'bytes')
+
+    def _draw(self, final=False):
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        with self._lock:
+            done = self.done_count()
+            nbytes = self.counters.get('bytes', 0)
+            statuses = ", ".join(f"{n} {name}" for name, n in sorted(self.counters.items())
+                                 if name != 'bytes' and name != 'done')
+        total = f"/{self.total}" if self.total else ""
+        line = (f"{done}{total} {self.unit} | {done / elapsed:.1f} {self.unit}/s | "
+                f"{nbytes / (1024 * 1024) / elapsed:.2f} MB/s")
+        if statuses:
+            line += f" | {statuses}"
+        with self._lock:
+            if self._tty and not final:
+                self.stream.write("\r\033[K" + line)
+                self._line_open = True
+            else:
+                if self._line_open:
+                    self.stream.write("\r\033[K")
+                self.stream.write(line + "\n")
+                self._line_open = False
+            self.stream.flush()
+
+    def snapshot(self):
+        """
+        Returns counters and per-stage timer summaries as a plain dict.
+        """
+        with self._lock:
+            return {
+                'elapsed': time.perf_counter() - self._started,
+                'counters': dict(self.counters),
+                'stages': {
+                    stage: {
+                        'count': t.count,
+                        'total': t.total,
+                        'mean': t.total / t.count if t.count else None,
+                        'p50': t.quantile(0.5),
+                        'p99': t.quantile(0.99),
+                        'max': t.max,
+                    }
+                    for stage, t in self.stages.items()
+                },
+            }
+
+    def prometheus_text(self):
+        """
+        Renders counters and stage timers in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            lines.append(f"# TYPE {METRIC_PREFIX}_items_total counter")
+            for name, n in sorted(self.counters.items()):
+                if name != 'bytes':
+                    lines.append(f'{METRIC_PREFIX}_items_total{{status="{name}"}} {n}')
+            lines.append(f"# TYPE {METRIC_PREFIX}_bytes_total counter")
+            lines.append(f"{METRIC_PREFIX}_bytes_total {self.counters.get('bytes', 0)}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_stage_seconds histogram")
+            for stage, t in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, n in zip(STAGE_BUCKETS, t.buckets):
+                    cumulative += n
+                    lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {t.count}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {t.total:.6f}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {t.count}')
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """
+        Draws the final progress line, writes the Prometheus dump and closes the event log.
+        """
+        if self.progress and self.done_count():
+            self._draw(final=True)
+        self.event('summary', **self.snapshot())
+        if self.prometheus_path:
+            with open(self.prometheus_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+        if self._log is not None:
+            with self._lock:
+                self._log.close()
+                self._log = None
@@ -0,0 +1,120 @@
+import json
+from collections import namedtuple
+
+# Reserved sections of park_coordinates.json; every other top-level key is an origPark
+ATTRACTIONS_KEY = "attractions"
+RESORTS_KEY = "resorts"
+
+# One geotag, with its EXIF GPS fields already converted
+Location = namedtuple('Location', [
+    'name',         # shown in logs, e.g. "BOARDWALK"
+    'lat',
+    'lon',
+    'gps_lat',      # DMS rationals, ((deg, 1), (min, 1), (sec, 10000))
+    'gps_lat_ref',  # b"N" / b"S"
+    'gps_lon',
+    'gps_lon_ref',  # b"E" / b"W"
+])
+
+def to_deg(value, loc):
+    """
+    Converts decimal coordinates to DMS (Degrees, Minutes, Seconds) tuple for EXIF.
+    """
+    if value < 0:
+        loc_value = loc[1]
+    else:
+        loc_value = loc[0]
+    abs_value = abs(value)
+    deg = int(abs_value)
+    t1 = (deg, 1)
+    min_val = (abs_value - deg) * 60
+    min_int = int(min_val)
+    t2 = (min_int, 1)
+    sec_val = (min_val - min_int) * 60
+    sec = int(sec_val * 10000)
+    t3 = (sec, 10000)
+    return (t1, t2, t3), loc_value
+
+def make_location(name, entry):
+    """
+    Builds a Location from a {"lat": .., "lon": ..} entry, or None if it has no position.
+    """
+    if not isinstance(entry, dict):
+        return None
+    lat = entry.get('lat')
+    lon = entry.get('lon')
+    if lat is None or lon is None:
+        return None
+    gps_lat, lat_ref = to_deg(lat, ["N", "S"])
+    gps_lon, lon_ref = to_deg(lon, ["E", "W"])
+    return Location(entry.get('name') or name, lat, lon, gps_lat, lat_ref.encode('utf-8'),
+                    gps_lon, lon_ref.encode('utf-8'))
+
+class LocationIndex:
+    """
+    Geotags for encounters, most precise first: the encounter's attractionId,
+    then its origPark, then its resort.
+
+    Built once from park_coordinates.json, whose top level maps origPark to
+    {"lat", "lon"} as before, plus optional "attractions" (attractionId ->
+    {"lat", "lon", "name"}) and "resorts" (resort name -> {"lat", "lon"})
+    sections. DMS values are worked out at load time, so tagging a photo
+    never converts coordinates.
+    Each place with no coordinates at all is reported once.
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.attractions = {}
+        self.parks = {}
+        self.resorts = {}
+        for key, entry in data.items():
+            if key == ATTRACTIONS_KEY:
+                for attraction_id, attraction in (entry or {}).items():
+                    location = make_location(f"attraction {attraction_id}", attraction)
+                    if location:
+                        self.attractions[str(attraction_id)] = location
+            elif key == RESORTS_KEY:
+                for resort, resort_entry in (entry or {}).items():
+                    location = make_location(resort, resort_entry)
+                    if location:
+                        self.resorts[resort] = location
+            else:
+                location = make_location(key, entry)
+                if location:
+                    self.parks[key] = location
+        self._missing = set()
+
+    def __len__(self):
+        return len(self.attractions) + len(self.parks) + len(self.resorts)
+
+    def lookup(self, encounter):
+        """
+        Returns the Location for an encounter, or None if nothing matches.
+        """
+        attraction_id = encounter.get('attractionId')
+        if attraction_id is not None:
+            location = self.attractions.get(str(attraction_id))
+            if location:
+                return location
+        orig_park = encounter.get('origPark')
+        location = self.parks.get(orig_park) or self.resorts.get(encounter.get('resort'))
+        if location is None and len(self) and orig_park not in self._missing:
+            self._missing.add(orig_park)
+            print(f"Warning: No coordinates for {orig_park} ({encounter.get('resort')}). "
+                  f"Add it to park_coordinates.json to geotag its photos.")
+        return location
+
+def load_locations(path='park_coordinates.json'):
+    """
+    Loads park_coordinates.json into a LocationIndex (empty if missing or invalid).
+    """
+    data = {}
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        print("Warning: park_coordinates.json not found. GPS tagging will be skipped.")
+    except json.JSONDecodeError:
+        print("Warning: Invalid JSON in park_coordinates.json.")
+    return LocationIndex(data)
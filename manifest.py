@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+MANIFEST_NAME = ".photopass_manifest.jsonl"
+
+class HashingWriter:
+    """
+    Wraps a file-like writer and hashes/counts everything written through it.
+    """
+
+    def __init__(self, writer):
+        self._writer = writer
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        return self._writer.write(chunk)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    Returns (size, sha256 hex) of a file on disk.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+def manifest_key(media_id, variant=None):
+    # Extra tiers of the same media are tracked separately
+    return f"{media_id}:{variant}" if variant else media_id
+
+def same_source(entry, job):
+    """
+    True if a manifest entry was fetched from the version of the media the
+    job now points at. The per-media guestMediaModifiedDate decides when
+    both sides have one; the encounter-wide encounterEtag is only the
+    fallback when it is missing.
+    """
+    if job.get('modified') is not None and entry.get('modified') is not None:
+        return entry['modified'] == job['modified']
+    return job.get('etag') is not None and entry.get('etag') == job.get('etag')
+
+def same_tier(entry, job):
+    """
+    True unless a manifest entry was saved from a different resolution tier
+    than the job asks for, e.g. a thumbnail when the run wants 'medium'.
+    Entries that don't record a tier match any.
+    """
+    return entry.get('tier') is None or entry['tier'] == job.get('tier')
+
+class Manifest:
+    """
+    Append-only JSONL record of every photo fetched into an output directory,
+    keyed by mediaId (plus the variant when several tiers are kept).
+    Each line stores the file it was saved as, its size and sha256, and the
+    encounterEtag / guestMediaModifiedDate it came from. A duplicate that
+    was skipped rather than saved points at the file it duplicates instead.
+
+    A line is appended (and flushed) as soon as a photo is finished, so a run
+    that is killed partway through resumes from the last finished photo.
+    Later lines for the same key override earlier ones.
+    """
+
+    def __init__(self, output_dir, name=MANIFEST_NAME, readonly=False):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, name)
+        self._lock = threading.Lock()
+        self.entries = {}
+        lines = self._load()
+        self._file = None
+        # A read-only manifest (e.g. for a dry run) never touches the file
+        if readonly:
+            return
+        if lines > 2 * len(self.entries) + 100:
+            self._compact()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        lines = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Half-written last line from a killed run
+                        continue
+                    lines += 1
+                    self.entries[manifest_key(entry['mediaId'], entry.get('variant'))] = entry
+        except FileNotFoundError:
+            pass
+        return lines
+
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def is_current(self, job):
+        """
+        True if this media was already fetched from the same version (see
+        same_source) at the same tier, and its file is still on disk with the
+        recorded size.
+        """
+        entry = self.lookup(job)
+        if not entry or not same_source(entry, job) or not same_tier(entry, job):
+            return False
+        path = entry.get('duplicateOf') or job['filepath']
+        try:
+            return os.path.getsize(path) == entry.get('size')
+        except OSError:
+            return False
+
+    def lookup(self, job):
+        """
+        Returns the manifest entry for a job's media and file name, or None.
+        """
+        entry = self.entries.get(manifest_key(job['media_id'], job.get('variant')))
+        if not entry or entry.get('filename') != job['filename']:
+            return None
+        return entry
+
+    def record(self, job, size, sha256, duplicate_of=None):
+        """
+        Appends a finished photo to the manifest.
+        """
+        entry = {
+            'mediaId': job['media_id'],
+            'variant': job.get('variant'),
+            'tier': job.get('tier'),
+            'filename': job['filename'],
+            'size': size,
+            'sha256': sha256,
+            'etag': job.get('etag'),
+            'modified': job.get('modified'),
+            'fetchedAt': datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        if duplicate_of:
+            entry['duplicateOf'] = duplicate_of
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self.entries[manifest_key(entry['mediaId'], entry['variant'])] = entry
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
@@ -0,0 +1,200 @@
+import heapq
+import itertools
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, parse_qs
+
+# Don't start a download whose link has less than this left
+DEFAULT_MIN_REMAINING = 60
+# How many upcoming jobs the scheduler looks ahead over when reordering
+DEFAULT_WINDOW = 5000
+# How many jobs are buffered before the first one is handed out
+DEFAULT_INITIAL_WINDOW = 16
+
+# Export fields for each resolution tier, smallest first
+TIER_FIELDS = {
+    'thumb': 'mediaThumb',
+    'medium': 'mediaMedium',
+    'base': 'mediaBase',
+}
+# Tiers to try, in order, when the requested one is missing from a media item
+TIER_FALLBACKS = {
+    'thumb': ('thumb', 'medium', 'base'),
+    'medium': ('medium', 'thumb', 'base'),
+    'base': ('base', 'medium', 'thumb'),
+}
+# Rough JPEG size per pixel for PhotoPass renditions, used to estimate bytes from dimensions
+BYTES_PER_PIXEL = 0.2
+
+def presigned_expiry(uri):
+    """
+    Returns when an S3 presigned URI stops working (X-Amz-Date + X-Amz-Expires)
+    as an aware UTC datetime, or None if the URI isn't presigned.
+    """
+    if not uri:
+        return None
+    query = parse_qs(urlsplit(uri).query)
+    try:
+        signed_at = datetime.strptime(query['X-Amz-Date'][0], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+        return signed_at + timedelta(seconds=int(query['X-Amz-Expires'][0]))
+    except (KeyError, IndexError, ValueError):
+        return None
+
+class ExpiryScheduler:
+    """
+    Reorders a stream of jobs so the ones whose presigned links expire
+    soonest are downloaded first. Jobs are buffered in a heap of at most
+    `window` entries, so memory stays bounded on huge exports. The first
+    job comes out once `initial_window` are buffered; after that one job
+    is handed out for every two read until the heap reaches `window`, so
+    downloads start while the export is still being parsed.
+    A job whose link has less than `min_remaining` seconds left when it
+    comes up is not returned; it is counted in `expired` instead.
+    Jobs without an expiry sort last.
+    """
+
+    def __init__(self, jobs, window=DEFAULT_WINDOW, min_remaining=DEFAULT_MIN_REMAINING, clock=None,
+                 initial_window=DEFAULT_INITIAL_WINDOW):
+        self.jobs = jobs
+        self.window = max(1, window)
+        self.initial_window = max(1, min(initial_window, self.window))
+        self.min_remaining = timedelta(seconds=min_remaining)
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+        self.expired = 0
+        self._heap = []
+        self._order = itertools.count()
+
+    def _push(self, job):
+        expires = job.get('expires')
+        key = expires.timestamp() if expires else float('inf')
+        heapq.heappush(self._heap, (key, next(self._order), job))
+
+    def _pop_live(self):
+        while self._heap:
+            _, _, job = heapq.heappop(self._heap)
+            expires = job.get('expires')
+            if expires is not None and expires - self.clock() < self.min_remaining:
+                self.expired += 1
+                continue
+            return job
+        return None
+
+    def __iter__(self):
+        limit = self.initial_window
+        for job in self.jobs:
+            self._push(job)
+            if len(self._heap) >= limit:
+                # Grow the look-ahead by one per job handed out until it reaches `window`
+                limit = min(limit + 1, self.window)
+                job = self._pop_live()
+                if job is not None:
+                    yield job
+        while self._heap:
+            job = self._pop_live()
+            if job is not None:
+                yield job
+
+def estimate_bytes(rendition):
+    """
+    Estimates a rendition's download size from its width/height, or 0 if unknown.
+    """
+    try:
+        return int(rendition['width'] * rendition['height'] * BYTES_PER_PIXEL)
+    except (KeyError, TypeError):
+        return 0
+
+class QualityPolicy:
+    """
+    Chooses which resolution tier(s) of each media item to download.
+
+    `quality` is 'thumb', 'medium', 'base' or 'best', or a list of those
+    to fetch several tiers in one pass (e.g. ['thumb', 'base']).
+    A named tier falls back to the others when the export doesn't have it.
+    'best' picks the largest tier within `max_pixels` and `max_mb`
+    (estimated from its dimensions), or the smallest one if none fit.
+    """
+
+    def __init__(self, quality='medium', max_pixels=None, max_mb=None):
+        if isinstance(quality, str):
+            quality = [quality]
+        for name in quality:
+            if name not in TIER_FIELDS and name != 'best':
+                raise ValueError(f"Unknown quality '{name}', expected one of: thumb, medium, base, best")
+        self.quality = list(quality)
+        self.max_pixels = max_pixels
+        self.max_bytes = max_mb * 1024 * 1024 if max_mb else None
+
+    def _available(self, media):
+        tiers = {}
+        for tier, field in TIER_FIELDS.items():
+            rendition = media.get(field)
+            if rendition and rendition.get('uri'):
+                tiers[tier] = rendition
+        return tiers
+
+    def _fits(self, rendition):
+        if self.max_pixels and (rendition.get('width') or 0) * (rendition.get('height') or 0) > self.max_pixels:
+            return False
+        if self.max_bytes and estimate_bytes(rendition) > self.max_bytes:
+            return False
+        return True
+
+    def _pick(self, name, tiers):
+        if name == 'best':
+            for tier in ('base', 'medium', 'thumb'):
+                if tier in tiers and self._fits(tiers[tier]):
+                    return tier
+            for tier in ('thumb', 'medium', 'base'):
+                if tier in tiers:
+                    return tier
+            return None
+        for tier in TIER_FALLBACKS[name]:
+            if tier in tiers:
+                return tier
+        return None
+
+    def choose(self, media):
+        """
+        Returns [(variant, tier, rendition), ...] for one media item.
+        `variant` is None for the first requested quality (saved under the
+        plain filename) and the quality name for any extra ones.
+        """
+        tiers = self._available(media)
+        chosen = []
+        seen_uris = set()
+        for i, name in enumerate(self.quality):
+            tier = self._pick(name, tiers)
+            if tier is None or tiers[tier]['uri'] in seen_uris:
+                continue
+            seen_uris.add(tiers[tier]['uri'])
+            chosen.append((None if i == 0 else name, tier, tiers[tier]))
+        return chosen
+
+class BandwidthBudget:
+    """
+    Passes jobs through until their estimated sizes add up to `budget_mb`.
+    Jobs that would go over are counted in `over_budget`; smaller ones later
+    in the stream can still fit.
+    """
+
+    def __init__(self, jobs, budget_mb=None):
+        self.jobs = jobs
+        self.budget = budget_mb * 1024 * 1024 if budget_mb else None
+        self.planned_bytes = 0
+        self.over_budget = 0
+
+    def __iter__(self):
+        for job in self.jobs:
+            size = job.get('est_bytes') or 0
+            if self.budget is not None and self.planned_bytes + size > self.budget:
+                self.over_budget += 1
+                continue
+            self.planned_bytes += size
+            yield job
+
+def is_expired(job, clock=None):
+    """
+    True if a job's presigned link has already expired.
+    """
+    expires = job.get('expires')
+    now = (clock or (lambda: datetime.now(timezone.utc)))()
+    return expires is not None and expires <= now
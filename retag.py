@@ -0,0 +1,198 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from copy_exif import JPEG_EXTENSIONS, normalize_name
+from download_photos import build_exif_bytes, build_jobs, open_export, retag_photo
+from file_times import set_times_many, to_ns
+from image_metadata import read_exif
+from instrumentation import Instrumentation
+from locations import load_locations
+from manifest import Manifest
+from planner import QualityPolicy
+from timezones import load_park_timezones
+
+# Per-file outcomes
+RETAGGED = 'retagged'
+TIMES_ONLY = 'times_only'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+
+# File times within this many seconds of the capture time count as correct
+# (FAT/exFAT drives store modified times in 2 second steps)
+TIME_TOLERANCE = 2
+
+def index_export(json_file_path, photo_dir):
+    """
+    Maps each media item's <timestamp>_<mediaId> stem (as normalize_name
+    gives it) to a job from build_jobs(), carrying its capture times and
+    geotag. Returns None if the export can't be opened.
+    """
+    reader = open_export(json_file_path)
+    if not reader:
+        return None
+    locations = load_locations()
+    timezones = load_park_timezones()
+    index = {}
+    # Only the capture data matters here, so one tier per media item is enough
+    for job in build_jobs(reader, locations, photo_dir, QualityPolicy('thumb'), timezones):
+        if job['capture_dt']:
+            index[normalize_name(job['filename'])] = job
+    return index
+
+def match_files(index, photo_dir):
+    """
+    Scans `photo_dir` once and pairs each JPEG with its media item by the
+    <timestamp>_<mediaId> part of its name; extra tiers saved with a
+    _<tier> suffix map to the same media item.
+    Returns (jobs, unmatched file names).
+    """
+    jobs = []
+    unmatched = []
+    with os.scandir(photo_dir) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if not entry.is_file() or not entry.name.lower().endswith(JPEG_EXTENSIONS):
+                continue
+            key = normalize_name(entry.name)
+            job = index.get(key)
+            if job is None:
+                unmatched.append(entry.name)
+                continue
+            variant = os.path.splitext(entry.name)[0][len(key):].lstrip("_") or None
+            jobs.append(dict(job, filename=entry.name, filepath=entry.path, variant=variant, tier=None))
+    return jobs, unmatched
+
+def retag_file(job, force=False):
+    """
+    Brings one downloaded photo's EXIF and file times in line with the
+    export, without touching its image data. A file whose EXIF already
+    matches but whose times don't is only reported as TIMES_ONLY; the
+    caller fixes those in one batch.
+    Runs inside pool workers, so it reports back instead of printing.
+    Returns (status, (size, sha256) if the file was rewritten, warning, timings).
+    """
+    timings = {}
+    try:
+        start = time.perf_counter()
+        expected, _ = build_exif_bytes(job['capture_dt'], job['local_dt'], job['location'], job.get('times'))
+        current = read_exif(job['filepath'])
+        timings['exif_read'] = time.perf_counter() - start
+        if current == expected and not force:
+            if abs(os.stat(job['filepath']).st_mtime - job['capture_dt'].timestamp()) <= TIME_TOLERANCE:
+                return UNCHANGED, None, None, timings
+            # Left to the batched pass at the end of retag_jobs()
+            return TIMES_ONLY, None, None, timings
+        start = time.perf_counter()
+        result = retag_photo(job)
+        timings['insert'] = time.perf_counter() - start
+        return RETAGGED, result, None, timings
+    except Exception as e:
+        return FAILED, None, f"Failed to re-tag {job['filename']}: {e}", timings
+
+def _retag_task(task):
+    return retag_file(*task)
+
+def keep_source(job, manifest):
+    """
+    Returns the job to record for a re-tagged file: the tier, etag and
+    modified date already in the manifest are kept, since the image data
+    still comes from that download.
+    """
+    entry = manifest.lookup(job)
+    if entry is None:
+        return job
+    return dict(job, tier=entry.get('tier'), etag=entry.get('etag'), modified=entry.get('modified'))
+
+def retag_jobs(jobs, photo_dir, workers=None, force=False, instrumentation=None):
+    """
+    Runs retag_file() over `jobs` on `workers` processes (default: one per
+    CPU; 1 runs in-process) and records rewritten files in the directory's
+    manifest, so incremental downloads still recognise them. Files that
+    only need their times fixed are done in one batch at the end.
+    Returns {status: count}.
+    """
+    instr = instrumentation or Instrumentation(unit="images")
+    instr.set_total(len(jobs))
+    tasks = [(job, force) for job in jobs]
+    counts = {RETAGGED: 0, TIMES_ONLY: 0, UNCHANGED: 0, FAILED: 0}
+    stale_times = []
+    manifest = Manifest(photo_dir)
+    workers = workers or os.cpu_count() or 1
+    executor = None
+    try:
+        if workers <= 1 or len(tasks) <= 1:
+            results = map(_retag_task, tasks)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            chunksize = max(1, min(64, len(tasks) // (workers * 4)))
+            results = executor.map(_retag_task, tasks, chunksize=chunksize)
+        for job, (status, rewritten, warning, timings) in zip(jobs, results):
+            counts[status] += 1
+            instr.add_timings(timings)
+            if warning:
+                instr.warn(warning)
+            if rewritten:
+                manifest.record(keep_source(job, manifest), *rewritten)
+                instr.info(f"  -> Re-tagged {job['filename']}")
+            instr.item_done(status, file=job['filename'], stages=timings)
+            if status == TIMES_ONLY:
+                stale_times.append((job['filepath'], to_ns(job['capture_dt'])))
+        if stale_times:
+            with instr.timer('utime'):
+                failed = set_times_many(stale_times)
+            for path, error in failed:
+                instr.warn(f"  -> Warning: Could not set file timestamps for {os.path.basename(path)}: {error}")
+            counts[TIMES_ONLY] -= len(failed)
+            counts[FAILED] += len(failed)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        manifest.close()
+        instr.close()
+    return counts
+
+def retag_library(json_file_path, photo_dir, workers=None, force=False, instrumentation=None):
+    """
+    Re-applies the current tagging (park_coordinates.json, park_timezones.json)
+    to a folder of already downloaded photos, with no network access.
+    Files are matched to the export's media by their <timestamp>_<mediaId>
+    name; only the EXIF segment and file times are rewritten, and files
+    whose embedded EXIF and modified time already match are left alone
+    (unless `force`). Work is spread over `workers` processes.
+    Returns the number of files re-tagged.
+    """
+    if not os.path.isdir(photo_dir):
+        print(f"Photo directory not found: {photo_dir}")
+        return 0
+    index = index_export(json_file_path, photo_dir)
+    if index is None:
+        return 0
+    jobs, unmatched = match_files(index, photo_dir)
+    print(f"Found {len(jobs)} photos from the export in {photo_dir}.")
+    if unmatched:
+        print(f"{len(unmatched)} files don't match any media in the export and were left alone.")
+
+    counts = retag_jobs(jobs, photo_dir, workers, force, instrumentation)
+    print(f"Finished. Re-tagged {counts[RETAGGED]} photos, fixed file times on {counts[TIMES_ONLY]}, "
+          f"{counts[UNCHANGED]} already up to date.")
+    if counts[FAILED]:
+        print(f"{counts[FAILED]} photos could not be re-tagged.")
+    return counts[RETAGGED]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Re-tag already downloaded PhotoPass photos without downloading them again.")
+    parser.add_argument('export', nargs='?', default="photos.json", help="export file, page directory or glob")
+    parser.add_argument('photo_dir', nargs='?', default="downloaded_photos")
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: one per CPU)")
+    parser.add_argument('--force', action='store_true', help="rewrite files even if their EXIF already matches")
+    parser.add_argument('--verbose', action='store_true', help="print every re-tagged file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    retag_library(args.export, args.photo_dir, args.workers, args.force,
+                  Instrumentation(unit="images", verbose=args.verbose))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import piexif
+
+from download_photos import build_exif_bytes, build_jobs, open_export, quality_policy
+from image_metadata import read_jpeg_exif
+from locations import load_locations
+from manifest import Manifest, hash_file, same_source, same_tier
+from planner import DEFAULT_MIN_REMAINING
+from retag import RETAGGED, retag_jobs
+from timezones import load_park_timezones
+
+# What a sync would do with each photo
+DOWNLOAD = 'download'   # missing, incomplete or changed in the export
+RETAG = 'retag'         # bytes are fine but the embedded EXIF is stale
+OK = 'ok'               # nothing to do
+EXPIRED = 'expired'     # would need downloading, but the link is dead
+ACTIONS = (DOWNLOAD, RETAG, OK, EXPIRED)
+
+EOI = b"\xff\xd9"
+
+# Reason for a complete, correctly tagged file the manifest doesn't know
+# about (e.g. from an older version of the script); download_photos()
+# would fetch it again, apply_retags() records it instead
+NOT_IN_MANIFEST = "not in manifest"
+
+PlanItem = namedtuple('PlanItem', ['job', 'reason'])
+
+class SyncPlan:
+    """
+    The photos of an export sorted by what a sync into an output directory
+    would do with them, plus the estimated bytes it would download.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.items = {action: [] for action in ACTIONS}
+        self.download_bytes = 0
+
+    def add(self, action, job, reason=None):
+        self.items[action].append(PlanItem(job, reason))
+        if action == DOWNLOAD:
+            self.download_bytes += job['est_bytes'] or 0
+
+    def counts(self):
+        return {action: len(items) for action, items in self.items.items()}
+
+    def report(self, show=50):
+        """
+        Prints the counts, up to `show` file names per action, and the bytes to transfer.
+        """
+        labels = {DOWNLOAD: "to download", RETAG: "to re-tag", OK: "up to date",
+                  EXPIRED: "to download, but their links have expired"}
+        for action in (DOWNLOAD, RETAG, EXPIRED):
+            items = self.items[action]
+            if not items:
+                continue
+            print(f"{len(items)} photos {labels[action]}:")
+            for item in items[:show]:
+                reason = f" ({item.reason})" if item.reason else ""
+                print(f"  {item.job['filename']}{reason}")
+            if len(items) > show:
+                print(f"  ... and {len(items) - show} more")
+        print(f"{len(self.items[OK])} photos {labels[OK]}.")
+        print(f"Would download ~{self.download_bytes / (1024 * 1024):.1f} MB.")
+
+def scan_output_dir(output_dir):
+    """
+    Lists an output directory once. Returns {file name: size}.
+    """
+    sizes = {}
+    try:
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    sizes[entry.name] = entry.stat().st_size
+    except FileNotFoundError:
+        pass
+    return sizes
+
+def link_is_dead(job, min_remaining=DEFAULT_MIN_REMAINING, now=None):
+    expires = job.get('expires')
+    now = now or datetime.now(timezone.utc)
+    return expires is not None and expires - now < timedelta(seconds=min_remaining)
+
+def embedded_exif(path):
+    """
+    Returns (exif payload or None, whether the JPEG ends with an EOI marker).
+    Only the header segments and the last two bytes are read.
+    """
+    with open(path, 'rb') as f:
+        exif = read_jpeg_exif(f)
+        f.seek(-2, os.SEEK_END)
+        complete = f.read(2) == EOI
+    return exif, complete
+
+def exif_difference(exif, times):
+    """
+    Names what is stale in an embedded EXIF payload that doesn't match the expected one.
+    """
+    try:
+        exif_ifd = piexif.load(exif)['Exif'] if exif else {}
+    except Exception:
+        return "EXIF unreadable"
+    if exif_ifd.get(piexif.ExifIFD.DateTimeOriginal) != times.datetime_original:
+        return "DateTimeOriginal differs"
+    if exif_ifd.get(piexif.ExifIFD.OffsetTimeOriginal) != times.offset.encode('utf-8'):
+        return "time zone differs"
+    return "EXIF differs"
+
+def classify(job, sizes, manifest):
+    """
+    Decides what a sync would do with one photo, looking only at the
+    directory listing, the manifest and the file's header segments.
+    Returns (action, reason), leaving EXPIRED to the caller.
+    """
+    size = sizes.get(job['filename'])
+    entry = manifest.lookup(job)
+    if entry and not same_source(entry, job):
+        return DOWNLOAD, "changed in export"
+    if entry and not same_tier(entry, job):
+        return DOWNLOAD, f"saved as {entry['tier']}"
+    if entry and entry.get('duplicateOf'):
+        # Saved under another name by dedup='skip'
+        try:
+            if os.path.getsize(entry['duplicateOf']) == entry.get('size'):
+                return OK, None
+        except OSError:
+            pass
+        return DOWNLOAD, "duplicate source missing"
+    if size is None:
+        return DOWNLOAD, "missing"
+    try:
+        exif, complete = embedded_exif(job['filepath'])
+    except OSError as e:
+        return DOWNLOAD, f"unreadable: {e}"
+    if not complete:
+        return DOWNLOAD, "incomplete JPEG"
+    stale = None
+    if job['capture_dt'] and job['local_dt']:
+        expected, _ = build_exif_bytes(job['capture_dt'], job['local_dt'], job['location'], job.get('times'))
+        if exif != expected:
+            stale = exif_difference(exif, job['times'])
+    if entry is None:
+        # A real run only skips what the manifest records
+        return DOWNLOAD, f"{NOT_IN_MANIFEST}, {stale}" if stale else NOT_IN_MANIFEST
+    # Rewriting the EXIF block changes the size, so a complete JPEG whose
+    # EXIF is stale only needs re-tagging
+    if stale:
+        return RETAG, stale
+    if entry and entry.get('size') != size:
+        return DOWNLOAD, "size differs from manifest"
+    return OK, None
+
+def plan_sync(json_file_path, output_dir, quality='medium', min_remaining=DEFAULT_MIN_REMAINING, show=50):
+    """
+    Compares an export with what is already in `output_dir` without any
+    network access, by generated file name, size (against the manifest)
+    and embedded EXIF (DateTimeOriginal, offset and GPS), and prints what a
+    download_photos() run would download, re-tag or leave alone.
+    Returns the SyncPlan; pass it to apply_retags() to fix stale EXIF in
+    place without downloading.
+    """
+    locations = load_locations()
+    timezones = load_park_timezones()
+    plan = SyncPlan(output_dir)
+    reader = open_export(json_file_path)
+    if not reader:
+        return plan
+
+    sizes = scan_output_dir(output_dir)
+    manifest = Manifest(output_dir, readonly=True)
+    now = datetime.now(timezone.utc)
+    for job in build_jobs(reader, locations, output_dir, quality_policy(quality), timezones):
+        action, reason = classify(job, sizes, manifest)
+        if action == DOWNLOAD and link_is_dead(job, min_remaining, now):
+            action = EXPIRED
+        plan.add(action, job, reason)
+    plan.report(show)
+    return plan
+
+def apply_retags(plan, workers=None, instrumentation=None):
+    """
+    Rewrites the EXIF block and file times of every photo the plan marked
+    RETAG, leaving the image data alone, on `workers` processes (see
+    retag.retag_jobs), and records them in the manifest.
+    Complete files the manifest doesn't know about (e.g. from an older
+    version of the script, planned as DOWNLOAD "not in manifest") are
+    re-tagged if their EXIF is stale and recorded either way, so the next
+    download_photos() run skips them. Returns the number of photos re-tagged.
+    """
+    unrecorded = [item for item in plan.items[DOWNLOAD] if item.reason and item.reason.startswith(NOT_IN_MANIFEST)]
+    retags = [item.job for item in plan.items[RETAG]]
+    retags += [item.job for item in unrecorded if item.reason != NOT_IN_MANIFEST]
+    counts = retag_jobs(retags, plan.output_dir, workers, force=True, instrumentation=instrumentation)
+    manifest = Manifest(plan.output_dir)
+    try:
+        for item in unrecorded:
+            job = item.job
+            if item.reason == NOT_IN_MANIFEST and os.path.exists(job['filepath']):
+                manifest.record(job, *hash_file(job['filepath']))
+    finally:
+        manifest.close()
+    print(f"Re-tagged {counts[RETAGGED]} photos.")
+    return counts[RETAGGED]
@@ -0,0 +1,115 @@
+import hashlib
+import io
+import os
+
+import piexif
+import pytest
+from PIL import Image
+
+from image_metadata import EXIF_HEADER, read_exif, read_jpeg_exif, splice_exif, write_exif
+
+MAKE = b"Disney PhotoPass"
+DATETIME_ORIGINAL = b"2026:01:18 14:14:20"
+
+# (extension, Pillow save arguments)
+FORMATS = {
+    'jpeg': ('.jpg', {'format': 'JPEG', 'quality': 90}),
+    'png': ('.png', {'format': 'PNG'}),
+    'webp': ('.webp', {'format': 'WEBP', 'quality': 80}),
+    'webp_lossless': ('.webp', {'format': 'WEBP', 'lossless': True}),
+}
+
+def make_exif(make=MAKE):
+    return piexif.dump({
+        "0th": {piexif.ImageIFD.Make: make},
+        "Exif": {piexif.ExifIFD.DateTimeOriginal: DATETIME_ORIGINAL},
+    })
+
+def make_image(tmp_path, name, fmt):
+    ext, options = FORMATS[fmt]
+    path = tmp_path / (name + ext)
+    img = Image.new('RGB', (40, 30))
+    for x in range(40):
+        for y in range(30):
+            img.putpixel((x, y), (x * 6, y * 8, (x * y) % 256))
+    img.save(path, **options)
+    return path
+
+def pixels(path):
+    with Image.open(path) as img:
+        return img.convert('RGB').tobytes()
+
+def assert_tagged(path, make=MAKE):
+    with Image.open(path) as img:
+        exif = img.getexif()
+        assert exif.get(piexif.ImageIFD.Make) == make.decode()
+        assert exif.get_ifd(0x8769).get(piexif.ExifIFD.DateTimeOriginal) == DATETIME_ORIGINAL.decode()
+
+@pytest.mark.parametrize('fmt', sorted(FORMATS))
+def test_write_then_read_round_trips(tmp_path, fmt):
+    path = make_image(tmp_path, "photo", fmt)
+    before = pixels(path)
+    write_exif(path, make_exif())
+    assert_tagged(path)
+    assert pixels(path) == before
+    assert read_exif(path)
+
+@pytest.mark.parametrize('fmt', sorted(FORMATS))
+def test_rewriting_replaces_existing_exif(tmp_path, fmt):
+    path = make_image(tmp_path, "photo", fmt)
+    write_exif(path, make_exif(b"first"))
+    write_exif(path, make_exif())
+    assert_tagged(path)
+
+@pytest.mark.parametrize('source_fmt', sorted(FORMATS))
+@pytest.mark.parametrize('target_fmt', sorted(FORMATS))
+def test_copy_between_formats(tmp_path, source_fmt, target_fmt):
+    source = make_image(tmp_path, "source", source_fmt)
+    target = make_image(tmp_path, "target", target_fmt)
+    write_exif(source, make_exif())
+    before = pixels(target)
+    write_exif(target, read_exif(source))
+    assert_tagged(target)
+    assert pixels(target) == before
+
+def test_jpeg_exif_from_bare_tiff_gets_header(tmp_path):
+    path = make_image(tmp_path, "photo", 'jpeg')
+    write_exif(path, make_exif()[len(EXIF_HEADER):])
+    with open(path, 'rb') as f:
+        assert read_jpeg_exif(f).startswith(EXIF_HEADER)
+    assert_tagged(path)
+
+def test_splice_matches_piexif_insert(tmp_path):
+    path = make_image(tmp_path, "photo", 'jpeg')
+    data = path.read_bytes()
+    expected = io.BytesIO()
+    piexif.insert(make_exif(), data, expected)
+    assert splice_exif(data, make_exif()) == expected.getvalue()
+
+def test_splice_rejects_non_jpeg():
+    with pytest.raises(ValueError):
+        splice_exif(b"\x89PNG\r\n\x1a\n", make_exif())
+
+@pytest.mark.parametrize('fmt', sorted(FORMATS))
+def test_digest_matches_written_file(tmp_path, fmt):
+    path = make_image(tmp_path, "photo", fmt)
+    image_format, size, sha256 = write_exif(path, make_exif(), digest=True)
+    data = path.read_bytes()
+    assert image_format in ("JPEG", "PNG", "WebP")
+    assert (size, sha256) == (len(data), hashlib.sha256(data).hexdigest())
+
+@pytest.mark.skipif(os.utime not in os.supports_fd, reason="needs fd-based os.utime")
+@pytest.mark.parametrize('fmt', sorted(FORMATS))
+def test_finish_runs_on_the_open_file(tmp_path, fmt):
+    path = make_image(tmp_path, "photo", fmt)
+    mtime_ns = 1_700_000_000_123_456_789
+    seen = []
+
+    def finish(fd):
+        seen.append(fd)
+        os.utime(fd, ns=(mtime_ns, mtime_ns))
+
+    write_exif(path, make_exif(), finish=finish)
+    assert len(seen) == 1
+    assert os.stat(path).st_mtime_ns == mtime_ns
+    assert_tagged(path)
@@ -0,0 +1,53 @@
+from manifest import Manifest, same_source, same_tier
+
+def make_job(tmp_path, etag="e1", modified="2026-01-01T00:00:00Z", filename="a.jpg", tier='medium'):
+    return {
+        'media_id': "123",
+        'variant': None,
+        'tier': tier,
+        'filename': filename,
+        'filepath': str(tmp_path / filename),
+        'etag': etag,
+        'modified': modified,
+    }
+
+def test_modified_date_decides_when_present(tmp_path):
+    entry = {'etag': "e1", 'modified': "2026-01-01T00:00:00Z"}
+    assert same_source(entry, make_job(tmp_path))
+    # Same encounter etag, but this media item was edited since
+    assert not same_source(entry, make_job(tmp_path, modified="2026-02-01T00:00:00Z"))
+    # Another media item of the encounter changed the etag; this one didn't
+    assert same_source(entry, make_job(tmp_path, etag="e2"))
+
+def test_etag_is_the_fallback(tmp_path):
+    assert same_source({'etag': "e1", 'modified': None}, make_job(tmp_path, modified=None))
+    assert not same_source({'etag': "e1", 'modified': None}, make_job(tmp_path, etag="e2", modified=None))
+    assert same_source({'etag': "e1"}, make_job(tmp_path))
+    assert not same_source({}, make_job(tmp_path, etag=None, modified=None))
+
+def test_is_current_after_reload(tmp_path):
+    job = make_job(tmp_path)
+    (tmp_path / "a.jpg").write_bytes(b"x" * 10)
+    manifest = Manifest(str(tmp_path))
+    manifest.record(job, 10, "0" * 64)
+    manifest.close()
+
+    manifest = Manifest(str(tmp_path), readonly=True)
+    assert manifest.is_current(job)
+    assert not manifest.is_current(make_job(tmp_path, modified="2026-02-01T00:00:00Z"))
+    (tmp_path / "a.jpg").write_bytes(b"x" * 11)
+    assert not manifest.is_current(job)
+
+def test_other_tier_is_not_current(tmp_path):
+    # A thumbnail sync followed by a medium one saves under the same name
+    (tmp_path / "a.jpg").write_bytes(b"x" * 10)
+    manifest = Manifest(str(tmp_path))
+    manifest.record(make_job(tmp_path, tier='thumb'), 10, "0" * 64)
+    assert manifest.is_current(make_job(tmp_path, tier='thumb'))
+    assert not manifest.is_current(make_job(tmp_path, tier='medium'))
+    manifest.close()
+
+def test_entry_without_tier_matches_any(tmp_path):
+    assert same_tier({'tier': None}, make_job(tmp_path, tier='base'))
+    assert same_tier({}, make_job(tmp_path, tier='thumb'))
+    assert not same_tier({'tier': 'thumb'}, make_job(tmp_path, tier='base'))
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+from planner import ExpiryScheduler
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+def make_jobs(offsets):
+    return [{'name': i, 'expires': NOW + timedelta(seconds=s) if s is not None else None}
+            for i, s in enumerate(offsets)]
+
+def test_first_job_comes_out_before_the_export_is_read():
+    read = []
+
+    def jobs():
+        for job in make_jobs([3600] * 10000):
+            read.append(job)
+            yield job
+
+    scheduler = ExpiryScheduler(jobs(), window=5000, initial_window=16, clock=lambda: NOW)
+    it = iter(scheduler)
+    next(it)
+    assert len(read) == 16
+    # One job out for every two read while the heap fills
+    for _ in range(99):
+        next(it)
+    assert len(read) == 16 + 2 * 99
+    assert len(list(it)) == 10000 - 100
+
+def test_heap_stops_growing_at_window():
+    read = []
+
+    def jobs():
+        for job in make_jobs([3600] * 100):
+            read.append(job)
+            yield job
+
+    it = iter(ExpiryScheduler(jobs(), window=8, initial_window=4, clock=lambda: NOW))
+    for _ in range(20):
+        next(it)
+    assert len(read) - 20 == 7
+
+def test_soonest_expiring_first_within_window():
+    jobs = make_jobs([500, None, 300, 100, 400, 200])
+    scheduler = ExpiryScheduler(jobs, window=10, initial_window=10, clock=lambda: NOW)
+    assert [job['name'] for job in scheduler] == [3, 5, 2, 4, 0, 1]
+
+def test_expired_links_are_counted_not_returned():
+    jobs = make_jobs([10, 3600, 30])
+    scheduler = ExpiryScheduler(jobs, min_remaining=60, clock=lambda: NOW)
+    assert [job['name'] for job in scheduler] == [1]
+    assert scheduler.expired == 2
@@ -0,0 +1,73 @@
+import io
+import os
+
+import piexif
+from PIL import Image
+
+from download_photos import build_exif_bytes, build_jobs, open_export, quality_policy
+from locations import load_locations
+from manifest import Manifest, hash_file
+from sync_plan import DOWNLOAD, NOT_IN_MANIFEST, OK, RETAG, SyncPlan, apply_retags, classify, scan_output_dir
+from timezones import load_park_timezones
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "photos_example.json")
+
+def example_jobs(output_dir, quality='medium'):
+    return list(build_jobs(open_export(EXAMPLE), load_locations(), str(output_dir), quality_policy(quality),
+                           load_park_timezones()))
+
+def save_photo(job, stale=False):
+    buffer = io.BytesIO()
+    Image.new('RGB', (16, 16), (10, 20, 30)).save(buffer, format='JPEG')
+    exif, _ = build_exif_bytes(job['capture_dt'], job['local_dt'], job['location'], job['times'])
+    if stale:
+        exif = piexif.dump({"Exif": {piexif.ExifIFD.DateTimeOriginal: b"2000:01:01 00:00:00"}})
+    data = io.BytesIO()
+    piexif.insert(exif, buffer.getvalue(), data)
+    with open(job['filepath'], 'wb') as f:
+        f.write(data.getvalue())
+
+def test_unrecorded_file_is_planned_as_download(tmp_path):
+    job = example_jobs(tmp_path)[0]
+    save_photo(job)
+    manifest = Manifest(str(tmp_path), readonly=True)
+    # download_photos() would fetch it again, so the plan must say so
+    assert classify(job, scan_output_dir(str(tmp_path)), manifest) == (DOWNLOAD, NOT_IN_MANIFEST)
+
+    writer = Manifest(str(tmp_path))
+    writer.record(job, *hash_file(job['filepath']))
+    assert classify(job, scan_output_dir(str(tmp_path)), writer) == (OK, None)
+    writer.close()
+
+def test_recorded_at_another_tier_is_planned_as_download(tmp_path):
+    job = example_jobs(tmp_path, 'thumb')[0]
+    save_photo(job)
+    manifest = Manifest(str(tmp_path))
+    manifest.record(job, *hash_file(job['filepath']))
+    medium = example_jobs(tmp_path, 'medium')[0]
+    assert classify(medium, scan_output_dir(str(tmp_path)), manifest) == (DOWNLOAD, "saved as thumb")
+    manifest.close()
+
+def test_apply_retags_adopts_unrecorded_files(tmp_path):
+    good, stale, recorded = example_jobs(tmp_path)[:3]
+    save_photo(good)
+    save_photo(stale, stale=True)
+    save_photo(recorded, stale=True)
+    manifest = Manifest(str(tmp_path))
+    manifest.record(recorded, *hash_file(recorded['filepath']))
+    manifest.close()
+
+    plan = SyncPlan(str(tmp_path))
+    manifest = Manifest(str(tmp_path), readonly=True)
+    sizes = scan_output_dir(str(tmp_path))
+    for job in (good, stale, recorded):
+        action, reason = classify(job, sizes, manifest)
+        plan.add(action, job, reason)
+    assert [item.job for item in plan.items[DOWNLOAD]] == [good, stale]
+    assert [item.job for item in plan.items[RETAG]] == [recorded]
+
+    assert apply_retags(plan, workers=1) == 2
+    manifest = Manifest(str(tmp_path), readonly=True)
+    for job in (good, stale, recorded):
+        assert manifest.is_current(job)
+        assert classify(job, scan_output_dir(str(tmp_path)), manifest) == (OK, None)
@@ -0,0 +1,136 @@
+import json
+import re
+from collections import namedtuple
+from datetime import datetime, timezone
+from functools import lru_cache
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo # For older Python versions
+
+DEFAULT_TIMEZONE = "America/New_York"
+
+# Fallback zones for the `resort` field, used when neither the origPark nor
+# the resort is listed in park_timezones.json
+RESORT_TIMEZONES = {
+    "The Walt Disney World Resort": "America/New_York",
+    "Walt Disney World Resort": "America/New_York",
+    "Disneyland Resort": "America/Los_Angeles",
+    "Aulani, A Disney Resort & Spa": "Pacific/Honolulu",
+    "Disneyland Paris": "Europe/Paris",
+    "Tokyo Disney Resort": "Asia/Tokyo",
+    "Hong Kong Disneyland Resort": "Asia/Hong_Kong",
+    "Shanghai Disney Resort": "Asia/Shanghai",
+}
+
+CAPTURE_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})Z")
+
+# A capture date converted once, with every string the filename and EXIF need
+CaptureTime = namedtuple('CaptureTime', [
+    'utc',                # aware UTC datetime
+    'local',              # aware datetime in the park's zone
+    'stamp',              # filename timestamp, "YYYY-MM-DD_HH-MM-SS" (UTC)
+    'datetime_original',  # EXIF local time, b"YYYY:MM:DD HH:MM:SS"
+    'offset',             # EXIF offset, "+HH:MM"
+    'gps_date',           # EXIF GPS date (UTC), b"YYYY:MM:DD"
+])
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    """
+    Returns a shared ZoneInfo for `name`, built once per process.
+    """
+    return ZoneInfo(name)
+
+@lru_cache(maxsize=None)
+def format_offset(offset):
+    # timedelta -> "+HH:MM"; there are only a handful of distinct offsets per run
+    minutes = int(offset.total_seconds()) // 60
+    sign = "-" if minutes < 0 else "+"
+    hours, minutes = divmod(abs(minutes), 60)
+    return f"{sign}{hours:02d}:{minutes:02d}"
+
+def parse_capture_date(value):
+    """
+    Parses a "2026-01-18T19:16:29Z" captureDate into an aware UTC datetime.
+    Raises ValueError if it isn't in that form.
+    """
+    match = CAPTURE_DATE.fullmatch(value) if isinstance(value, str) else None
+    if match is None:
+        # Rare odd formats still get strptime's error message
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return datetime(*map(int, match.groups()), tzinfo=timezone.utc)
+
+def capture_time(utc, local):
+    """
+    Builds the CaptureTime for an already-converted pair of datetimes.
+    """
+    return CaptureTime(
+        utc,
+        local,
+        f"{utc.year:04d}-{utc.month:02d}-{utc.day:02d}_{utc.hour:02d}-{utc.minute:02d}-{utc.second:02d}",
+        (f"{local.year:04d}:{local.month:02d}:{local.day:02d} "
+         f"{local.hour:02d}:{local.minute:02d}:{local.second:02d}").encode('utf-8'),
+        format_offset(local.utcoffset()),
+        f"{utc.year:04d}:{utc.month:02d}:{utc.day:02d}".encode('utf-8'),
+    )
+
+def convert_capture_dates(values, zone):
+    """
+    Converts a batch of captureDate strings to CaptureTimes in `zone` (a
+    ZoneInfo) in one pass. Repeated dates are converted once.
+    Returns a list aligned with `values`; entries that can't be parsed are
+    the ValueError/TypeError raised for them, so the caller can report it.
+    """
+    converted = {}
+    results = []
+    for value in values:
+        result = converted.get(value) if isinstance(value, str) else None
+        if result is None:
+            try:
+                utc = parse_capture_date(value)
+                result = capture_time(utc, utc.astimezone(zone))
+            except (ValueError, TypeError) as e:
+                result = e
+            if isinstance(value, str):
+                converted[value] = result
+        results.append(result)
+    return results
+
+class TimezoneMap:
+    """
+    Picks the timezone for an encounter: its origPark, then its resort, as
+    listed in park_timezones.json, then the built-in resort table, then
+    America/New_York.
+    """
+
+    def __init__(self, mapping=None, default=DEFAULT_TIMEZONE):
+        self.mapping = mapping or {}
+        self.default = default
+        # Fail on a typo'd zone name at load time rather than mid-run
+        for name in set(self.mapping.values()) | {default}:
+            get_zone(name)
+
+    def zone_name(self, encounter):
+        for key in (encounter.get('origPark'), encounter.get('resort')):
+            if key in self.mapping:
+                return self.mapping[key]
+        return RESORT_TIMEZONES.get(encounter.get('resort'), self.default)
+
+    def zone_for(self, encounter):
+        return get_zone(self.zone_name(encounter))
+
+def load_park_timezones(path='park_timezones.json'):
+    """
+    Loads the origPark/resort -> IANA timezone map (e.g. {"POLY": "America/New_York"}).
+    A missing file just means the built-in resort table is used.
+    """
+    mapping = {}
+    try:
+        with open(path, 'r') as f:
+            mapping = json.load(f)
+    except FileNotFoundError:
+        pass
+    except json.JSONDecodeError:
+        print(f"Warning: Invalid JSON in {path}. Using default timezones.")
+    return TimezoneMap(mapping)